@@ -1,21 +1,50 @@
+import asyncio
 import base64
 import json
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, Body, HTTPException, Query
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Body, HTTPException, Query, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import numpy as np
 import cv2
 from animatch.app.services.explain import explain_match
-from animatch.app.services.match import match_characters, load_characters
-from animatch.app.services.landmarks import extract_landmarks, draw_landmarks_on_image
-from animatch.app.services.features import landmarks_to_features
-app = FastAPI(title="Animatch")
+from animatch.app.services.match import (
+    match_characters, match_characters_batch, load_characters, current_catalog, update_characters, compact_catalog,
+)
+from animatch.app.services.schema import FEATURES
+from animatch.app.services.executor import PoolOverloaded, extract_features, pipeline_pool
+from animatch.app.services.batcher import match_batcher
+from animatch.app.services.cache import result_cache
+from animatch.app.services.reloader import dataset_reloader
 from animatch.app.services import landmarks as landmarks_service
 
-# preload model once at startup
-landmarks_service._get_landmarker()
+
+# required in X-Admin-Token for /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("ANIMATCH_ADMIN_TOKEN") or None
+# snapshot of the character catalog a response was served from
+CATALOG_VERSION_HEADER = "X-Catalog-Version"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # spawn the worker processes now, each preloading its own landmarker
+    await pipeline_pool.warm()
+    # load the catalog before serving; later datasets are swapped in by the watcher
+    load_characters()
+    dataset_reloader.start()
+    yield
+    dataset_reloader.stop()
+    pipeline_pool.shutdown()
+
+
+app = FastAPI(title="Animatch", lifespan=lifespan)
+
+# preload model once at startup (only used in-process when the pool is disabled)
+if pipeline_pool.workers == 0:
+    landmarks_service._get_landmarker()
 
 # Allow local files and simple dev servers to call the API
 app.add_middleware(
@@ -24,17 +53,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CATALOG_VERSION_HEADER],
 )
+
+
+@app.middleware("http")
+async def catalog_version_header(request: Request, call_next):
+    # endpoints that read the catalog set the header from their own snapshot
+    response = await call_next(request)
+    catalog = current_catalog()
+    if catalog is not None and CATALOG_VERSION_HEADER.lower() not in response.headers:
+        response.headers[CATALOG_VERSION_HEADER] = str(catalog.version)
+    return response
+
+
+def _served_from(response: Response, catalog) -> None:
+    response.headers[CATALOG_VERSION_HEADER] = str(catalog.version)
+
 app.mount("/static", StaticFiles(directory="animatch/data"), name="static")
 SERIES_POSTERS_PATH = Path("animatch/app/data/series_posters.json")
 
 @app.get("/health")
-def health():
-    chars, _, mtime = load_characters()
+def health(response: Response):
+    catalog = load_characters()
+    _served_from(response, catalog)
     return {
         "status": "ok",
-        "characters": len(chars),
-        "dataset_mtime": mtime,
+        "characters": len(catalog),
+        "dataset_mtime": catalog.mtime,
+        "catalog_version": catalog.version,
+        "pending_updates": catalog.pending,
+        "dataset_reloader": dataset_reloader.stats(),
+        "pipeline": pipeline_pool.stats(),
+        "landmarkers": landmarks_service.landmarker_pool.stats(),
+        "batcher": match_batcher.stats(),
+        "result_cache": result_cache.stats(),
     }
 
 @app.post("/inspect")#register a route that accepts post request 
@@ -61,25 +114,57 @@ async def inspect(file: UploadFile = File(...)):
     }
 
 @app.get("/characters")
-def characters():
-    chars, _, _ = load_characters()
+def characters(response: Response):
+    chars = load_characters()
+    _served_from(response, chars)
     return [{"id": c["id"], "name": c["name"], "series": c["series"], "tags": c.get("tags", []), "image_url": c.get("image_url")} for c in chars]
 
 
+@app.get("/characters/{char_id}/similar")
+def similar_characters(char_id: str, response: Response, top_k: int = Query(10)):
+    """Characters that look most like `char_id`, read from the precomputed
+    neighbour graph (at most ANIMATCH_SIMILAR_K of them)."""
+    catalog = load_characters()
+    _served_from(response, catalog)
+    row = catalog.row_ids().get(char_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Unknown character {char_id!r}.")
+    features = FEATURES.row(catalog[row]["vector"])
+    matches = catalog.similar(row, top_k=max(top_k, 0))
+    for m in matches:
+        m["reasons"] = explain_match(features, m["vector"])
+    return {"id": char_id, "matches": matches}
+
+
 @app.get("/series")
 def series():
     if SERIES_POSTERS_PATH.exists():
         return json.loads(SERIES_POSTERS_PATH.read_text(encoding="utf-8"))
     return []
 
-def _run_match_pipeline(data: bytes, top_k: int, debug: bool, return_image: bool) -> dict:
-    landmarks, quality = extract_landmarks(data)
+@app.get("/series/stats")
+def series_stats(response: Response, series: Optional[List[str]] = Query(None)):
+    """Per-series character count, tags and feature mean/std; every series unless `series` is given."""
+    catalog = load_characters()
+    _served_from(response, catalog)
+    names = series or list(catalog.series_lookup)
+    out = [catalog.series_stats(name) for name in names]
+    missing = [name for name, stats in zip(names, out) if stats is None]
+    if series and missing:
+        raise HTTPException(status_code=404, detail=f"Unknown series: {missing}")
+    return [stats for stats in out if stats is not None]
+
+
+def _build_match_response(extracted, top_k: int, debug: bool, matches=None, catalog=None) -> dict:
+    """Match + explain step on the output of executor.extract_features.
+    Pass `matches` when the scoring already ran (e.g. through the batcher),
+    or `catalog` to score against a specific snapshot."""
+    landmarks, quality, features, overlay = extracted
     if landmarks is None:
         raise HTTPException(status_code=400, detail="No face detected. Try better lighting and face the camera.")
 
-    features = landmarks_to_features(landmarks)
-
-    matches = match_characters(features, top_k=top_k)
+    if matches is None:
+        matches = match_characters(features, top_k=top_k, catalog=catalog)
     for m in matches:
         m["reasons"] = explain_match(features, m["vector"])
 
@@ -99,11 +184,10 @@ def _run_match_pipeline(data: bytes, top_k: int, debug: bool, return_image: bool
 
     if debug:
         resp["debug"] = {
-            "features": features,
+            "features": FEATURES.as_dict(features),
             "landmark_count": len(landmarks),
         }
-    if return_image:
-        overlay = draw_landmarks_on_image(data, landmarks)
+    if overlay is not None:
         resp["debug_image_b64"] = base64.b64encode(overlay).decode("ascii")
 
     warnings = []
@@ -135,14 +219,34 @@ async def _read_image_file(file: UploadFile) -> bytes:
 
 @app.post("/match")
 async def match(
+    response: Response,
     file: UploadFile = File(...),
     top_k: int = Query(4),
     debug: bool = Query(False),
     return_image: bool = Query(False, description="Return base64 PNG with plotted landmarks"),
+    series: Optional[List[str]] = Query(None, description="Only match characters from these series"),
+    exclude_series: Optional[List[str]] = Query(None, description="Never match characters from these series"),
+    tags: Optional[List[str]] = Query(None, description="Only match characters carrying all of these tags"),
 ):
     try:
         data = await _read_image_file(file)
-        return _run_match_pipeline(data, top_k=top_k, debug=debug, return_image=return_image)
+        # retries of the same photo skip decode + MediaPipe and only rerun matching;
+        # hashing and spilled entries touch the CPU and disk, so the cache runs on a thread
+        loop = asyncio.get_running_loop()
+        cache_key = await loop.run_in_executor(None, result_cache.key, data)
+        extracted = await loop.run_in_executor(None, result_cache.get, cache_key, return_image)
+        if extracted is None:
+            # decode + MediaPipe run in a worker process so the event loop keeps serving
+            extracted = await pipeline_pool.run(extract_features, data, return_image)
+            await loop.run_in_executor(None, result_cache.put, cache_key, extracted)
+        if extracted[0] is None:
+            return _build_match_response(extracted, top_k=top_k, debug=debug)
+        # scoring is batched with whatever other uploads finished in the same few ms
+        catalog, matches = await match_batcher.submit(extracted[2], top_k, series, exclude_series, tags)
+        _served_from(response, catalog)
+        return _build_match_response(extracted, top_k=top_k, debug=debug, matches=matches)
+    except PoolOverloaded:
+        raise HTTPException(status_code=503, detail="Server is busy. Try again in a moment.", headers={"Retry-After": "1"})
     except HTTPException:
         raise
     except Exception as exc:
@@ -150,8 +254,22 @@ async def match(
 
 
 @app.post("/match/features")
-def match_features(features = Body(...), top_k = 4):
-    matches = match_characters(features, top_k=top_k)
+def match_features(
+    response: Response,
+    features = Body(...),
+    top_k: int = Query(4),
+    series: Optional[List[str]] = Query(None),
+    exclude_series: Optional[List[str]] = Query(None),
+    tags: Optional[List[str]] = Query(None),
+):
+    try:
+        features = FEATURES.row(features)
+    except (KeyError, ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid feature vector: {exc}")
+    catalog = load_characters()
+    _served_from(response, catalog)
+    matches = match_characters(features, top_k=top_k, catalog=catalog,
+                               series=series, exclude_series=exclude_series, tags=tags)
 
     for m in matches:
         m["reasons"] = explain_match(features, m["vector"])
@@ -162,6 +280,98 @@ def match_features(features = Body(...), top_k = 4):
     }
 
 
+@app.post("/match/features/batch")
+def match_features_batch(
+    response: Response,
+    vectors = Body(...),
+    top_k: int = Query(4),
+    series: Optional[List[str]] = Query(None),
+    exclude_series: Optional[List[str]] = Query(None),
+    tags: Optional[List[str]] = Query(None),
+):
+    """Body is a list of feature dicts or of 8-number arrays in FEATURES order."""
+    if isinstance(vectors, dict):
+        vectors = vectors.get("vectors", [])
+    try:
+        vectors = FEATURES.matrix(vectors)
+        catalog = load_characters()
+        batch = match_characters_batch(vectors, top_k=top_k, catalog=catalog,
+                                       series=series, exclude_series=exclude_series, tags=tags)
+    except (KeyError, ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid feature vectors: {exc}")
+
+    results = []
+    for features, matches in zip(vectors, batch):
+        for m in matches:
+            m["reasons"] = explain_match(features, m["vector"])
+        results.append({"matches": matches, "quality": None})
+
+    _served_from(response, catalog)
+    return {"results": results}
+
+
+def _require_admin(token) -> None:
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ANIMATCH_ADMIN_TOKEN).")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.post("/admin/reload")
+def admin_reload(response: Response, x_admin_token: str = Header(None)):
+    """Rebuild the catalog from the dataset files and swap it in."""
+    _require_admin(x_admin_token)
+    try:
+        catalog = dataset_reloader.reload(force=True)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving the previous catalog: {exc}")
+    _served_from(response, catalog)
+    return _catalog_summary(catalog)
+
+
+def _catalog_summary(catalog) -> dict:
+    return {
+        "catalog_version": catalog.version,
+        "characters": len(catalog),
+        "dataset_mtime": catalog.mtime,
+        "pending_updates": catalog.pending,
+    }
+
+
+@app.post("/admin/characters")
+def admin_upsert_characters(response: Response, characters = Body(...), x_admin_token: str = Header(None)):
+    """Add or replace characters (one object or a list, shaped like anime_vectors.json rows)."""
+    _require_admin(x_admin_token)
+    if isinstance(characters, dict):
+        characters = [characters]
+    try:
+        catalog = update_characters(upserts=characters)
+    except (KeyError, ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid characters: {exc}")
+    _served_from(response, catalog)
+    return _catalog_summary(catalog)
+
+
+@app.delete("/admin/characters/{char_id}")
+def admin_delete_character(char_id: str, response: Response, x_admin_token: str = Header(None)):
+    _require_admin(x_admin_token)
+    try:
+        catalog = update_characters(deletes=[char_id])
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown character {char_id!r}.")
+    _served_from(response, catalog)
+    return _catalog_summary(catalog)
+
+
+@app.post("/admin/compact")
+def admin_compact(response: Response, x_admin_token: str = Header(None)):
+    """Fold the update log into anime_vectors.json and the compiled catalog."""
+    _require_admin(x_admin_token)
+    catalog = compact_catalog()
+    _served_from(response, catalog)
+    return _catalog_summary(catalog)
+
+
 @app.post("/describe")
 async def describe(body: dict = Body(...)):
     name = body.get("name", "")
@@ -0,0 +1,107 @@
+"""Micro-batching of catalog scoring for concurrent /match requests."""
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+from animatch.app.services.match import load_characters, match_characters_batch
+
+# flush when this many requests are queued...
+BATCH_MAX = int(os.environ.get("ANIMATCH_BATCH_MAX", "16"))
+# ...or when the oldest one has waited this long
+BATCH_WAIT_MS = float(os.environ.get("ANIMATCH_BATCH_WAIT_MS", "5"))
+
+
+class MatchBatcher:
+    """Collects feature vectors from concurrent requests over a small time/size
+    window and scores each window with one match_characters_batch call per
+    (top_k, filters) group, on a worker thread so the event loop stays free. A window is scored against
+    a single catalog snapshot."""
+
+    def __init__(self, max_batch: int = BATCH_MAX, max_wait_ms: float = BATCH_WAIT_MS) -> None:
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = []  # (features, top_k, future, enqueued_at, filters)
+        self._timer = None
+        self.batches = 0
+        self.requests = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.score_total = 0.0
+
+    async def submit(self, features, top_k: int, series=None, exclude_series=None, tags=None) -> tuple:
+        """Queue one feature vector (array in FEATURES order, or dict); resolves
+        to (catalog, matches) with the snapshot the matches came from. The
+        filters are passed through to match_characters_batch."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        filters = tuple(tuple(v) if v else None for v in (series, exclude_series, tags))
+        self._queue.append((features, top_k, fut, time.perf_counter(), filters))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._queue = self._queue, []
+        if not items:
+            return
+        now = time.perf_counter()
+        self.batches += 1
+        self.requests += len(items)
+        self.wait_total += sum(now - item[3] for item in items)
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(None, self._score, items, loop)
+
+    def _score(self, items, loop) -> None:
+        start = time.perf_counter()
+        try:
+            catalog = load_characters()
+        except Exception as exc:
+            for item in items:
+                loop.call_soon_threadsafe(_resolve, item[2], None, exc)
+            return
+        groups = defaultdict(list)
+        for item in items:
+            groups[item[1], item[4]].append(item)
+        for (top_k, (series, exclude_series, tags)), group in groups.items():
+            try:
+                results = match_characters_batch([item[0] for item in group], top_k=top_k, catalog=catalog,
+                                                 series=series, exclude_series=exclude_series, tags=tags)
+            except Exception as exc:
+                for item in group:
+                    loop.call_soon_threadsafe(_resolve, item[2], None, exc)
+                continue
+            for item, matches in zip(group, results):
+                loop.call_soon_threadsafe(_resolve, item[2], (catalog, matches), None)
+        self.score_total += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "avg_queue_wait_ms": round(1000.0 * self.wait_total / self.requests, 3) if self.requests else 0.0,
+            "avg_score_ms": round(1000.0 * self.score_total / self.batches, 3) if self.batches else 0.0,
+        }
+
+
+def _resolve(fut, result, exc) -> None:
+    if fut.done():  # caller went away
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+match_batcher = MatchBatcher()
@@ -0,0 +1,212 @@
+"""Content-addressed cache of image pipeline results for repeated uploads."""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from animatch.app.services import landmarks as landmarks_service
+from animatch.app.services.schema import FEATURES
+
+# entries kept in memory; 0 disables the cache
+CACHE_SIZE = int(os.environ.get("ANIMATCH_CACHE_SIZE", "512"))
+# optional directory that evicted entries spill to, and its size budget
+CACHE_DIR = os.environ.get("ANIMATCH_CACHE_DIR") or None
+CACHE_DISK_MB = int(os.environ.get("ANIMATCH_CACHE_DISK_MB", "256"))
+# bump when the cached (landmarks, quality, features, overlay) tuple or its spill format changes
+ENTRY_FORMAT = 3
+
+
+def model_fingerprint(path: Path = landmarks_service.MODEL_PATH) -> str:
+    """Changes whenever the landmarker model file is replaced."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return "missing"
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+class ResultCache:
+    """LRU of executor.extract_features results keyed on a hash of the upload.
+    The key also covers the model file, decode cap, feature schema and entry
+    format, so changing any of them invalidates old entries.
+
+    Evicted entries spill to `spill_dir` as .npz files (arrays plus the quality
+    dict as JSON, never pickles), oldest first out once the directory passes
+    `max_spill_bytes`. The directory is listed once at startup; after that its
+    size is tracked in memory. get/put may touch the disk, so async callers
+    run them on a thread."""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, spill_dir: Optional[str] = CACHE_DIR,
+                 max_spill_bytes: int = CACHE_DISK_MB * 1024 * 1024, fingerprint_ttl: float = 5.0) -> None:
+        self.max_entries = max_entries
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_spill_bytes = max_spill_bytes
+        self.fingerprint_ttl = fingerprint_ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._fingerprint_at = 0.0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        self._spilled: OrderedDict = OrderedDict()  # key -> file size, oldest first
+        self._spill_bytes = 0
+        self._spill_lock = threading.Lock()
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_spill()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _model_tag(self) -> str:
+        # re-stat the model file at most every fingerprint_ttl seconds
+        now = time.monotonic()
+        if self._fingerprint is None or now - self._fingerprint_at > self.fingerprint_ttl:
+            fingerprint = model_fingerprint()
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                with self._lock:
+                    self._entries.clear()
+            self._fingerprint = fingerprint
+            self._fingerprint_at = now
+        return self._fingerprint
+
+    def key(self, data: bytes) -> str:
+        h = hashlib.sha256(data)
+        tag = f"|{self._model_tag()}|{landmarks_service.MAX_DECODE_DIM}|{FEATURES.version}|{ENTRY_FORMAT}"
+        h.update(tag.encode("ascii"))
+        return h.hexdigest()
+
+    def get(self, key: str, need_overlay: bool = False):
+        """Cached (landmarks, quality, features, overlay) or None. An entry
+        without an overlay does not count when the caller needs one."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load_spilled(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._insert(key, entry)
+        if entry is None or (need_overlay and entry[0] is not None and entry[3] is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry) -> None:
+        if self.enabled:
+            self._insert(key, entry)
+
+    def _insert(self, key: str, entry) -> None:
+        evicted = []
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+                self.evictions += 1
+        for old_key, old_entry in evicted:
+            self._spill(old_key, old_entry)
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{key}.npz"
+
+    def _scan_spill(self) -> None:
+        files = []
+        for p in self.spill_dir.glob("*.npz"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, p.stem, st.st_size))
+        for _, key, size in sorted(files):
+            self._spilled[key] = size
+            self._spill_bytes += size
+        self._trim_spill()
+
+    def _spill(self, key: str, entry) -> None:
+        if self.spill_dir is None:
+            return
+        landmarks, quality, features, overlay = entry
+        arrays = {"quality": np.frombuffer(json.dumps(quality, default=_json_scalar).encode("utf-8"), dtype=np.uint8)}
+        if landmarks is not None:
+            arrays["landmarks"] = landmarks
+        if features is not None:
+            arrays["features"] = features
+        if overlay is not None:
+            arrays["overlay"] = np.frombuffer(overlay, dtype=np.uint8)
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        data = buf.getvalue()
+        path = self._spill_path(key)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._spill_lock:
+            self._spill_bytes += len(data) - self._spilled.pop(key, 0)
+            self._spilled[key] = len(data)
+        self.spills += 1
+        self._trim_spill()
+
+    def _load_spilled(self, key: str):
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                quality = json.loads(npz["quality"].tobytes().decode("utf-8"))
+                landmarks = npz["landmarks"] if "landmarks" in npz.files else None
+                features = npz["features"] if "features" in npz.files else None
+                overlay = npz["overlay"].tobytes() if "overlay" in npz.files else None
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+        path.unlink(missing_ok=True)  # back in memory; spilled again on eviction
+        with self._spill_lock:
+            self._spill_bytes -= self._spilled.pop(key, 0)
+        return landmarks, quality, features, overlay
+
+    def _trim_spill(self) -> None:
+        victims = []
+        with self._spill_lock:
+            while self._spill_bytes > self.max_spill_bytes and self._spilled:
+                key, size = self._spilled.popitem(last=False)
+                self._spill_bytes -= size
+                victims.append(key)
+        for key in victims:
+            self._spill_path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "spill_bytes": self._spill_bytes,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _json_scalar(value):
+    # quality flags come out of NumPy comparisons as np.bool_ / np.float64
+    return value.item()
+
+
+result_cache = ResultCache()
@@ -0,0 +1,278 @@
+"""Compact on-disk catalog read by the API instead of anime_vectors.json.
+
+A catalog is a directory of:
+  vectors.npy   float32 (N, F) raw features
+  norm.npy      float32 (N, F) z-scored features
+  boost.npy     float64 (N,)   distinctiveness boost
+  strings.bin   utf-8 blob with every text column back to back
+  offsets.npy   int64 (N * C + 1,) start of row i, column j at i * C + j
+  neighbors.npy int32 (N, K)   "similar characters" graph, best first, -1 padded (optional)
+  <dtype>_codes.npy, <dtype>_scale.npy, <dtype>_sq_norms.npy
+                int8 / float16 scan arrays of the quantized indexes (optional)
+  series_codes.npy int32 (N,) series code per row, codes in first-seen order
+  tag_rows.npy  int64 (T,)    sorted row ids of every tag, tag after tag
+  tag_offsets.npy int64 (n_tags + 1,) start of each tag's rows in tag_rows.npy
+  filters.json  series name per code and tag names, in tag_offsets order
+  meta.json     format version, feature order, columns, stats, graph width,
+                quantized dtypes, sha256 of the anime_vectors.json it was compiled from
+
+The arrays are opened with mmap_mode="r", so every worker process shares the
+same page-cache pages and startup does not parse anything proportional to N;
+the filter arrays spare it decoding the series and tags of every row.
+"""
+import hashlib
+import json
+import os
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+COLUMNS = ["id", "name", "series", "tags", "image_url", "overlay_url"]
+META_NAME = "meta.json"
+GRAPH_NAME = "neighbors.npy"
+FILTERS_NAME = "filters.json"
+QUANT_PARTS = ("codes", "scale", "sq_norms")
+
+
+def _write_atomic(path: Path, write) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _encode(record: dict, column: str) -> bytes:
+    value = record.get(column)
+    if column == "tags":
+        return json.dumps(value or [], ensure_ascii=False).encode("utf-8")
+    return b"" if value is None else str(value).encode("utf-8")
+
+
+def _filter_arrays(chunks: list, count: int):
+    """Series codes and tag inverted index of encoded rows, decoded the way
+    CharacterTable reads them back: (codes, series names, tags, rows, offsets)."""
+    width = len(COLUMNS)
+    series_col, tags_col = COLUMNS.index("series"), COLUMNS.index("tags")
+    lookup = {}
+    codes = np.array([lookup.setdefault(chunks[row * width + series_col].decode("utf-8") or None, len(lookup))
+                      for row in range(count)], dtype=np.int32)
+    tag_rows = {}
+    for row in range(count):
+        for tag in json.loads(chunks[row * width + tags_col]):
+            tag_rows.setdefault(tag, []).append(row)
+    rows = np.array([row for rows in tag_rows.values() for row in rows], dtype=np.int64)
+    offsets = np.zeros(len(tag_rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in tag_rows.values()], out=offsets[1:])
+    return codes, list(lookup), list(tag_rows), rows, offsets
+
+
+def file_sha256(path: Path):
+    """Hex sha256 of a file's bytes, or None if it does not exist."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def write_catalog(out_dir: Path, records: list[dict], features: list[str], stats: dict,
+                  vectors: np.ndarray, norm: np.ndarray, boost: np.ndarray, graph: np.ndarray = None,
+                  source_sha256: str = None, quantized: dict = None) -> Path:
+    """Write a catalog directory. meta.json goes last so a reader never sees a
+    newer meta next to older arrays. `source_sha256` is the hash of the JSON
+    the records came from; readers use it to tell whether the catalog is stale.
+    `quantized` maps a dtype to its (codes, scale, sq_norms)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    chunks = [_encode(r, col) for r in records for col in COLUMNS]
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in chunks], out=offsets[1:])
+
+    def save(name, arr):
+        def write(p):
+            with open(p, "wb") as fh:
+                np.save(fh, arr)
+        _write_atomic(out_dir / name, write)
+
+    save("vectors.npy", np.ascontiguousarray(vectors, dtype=np.float32))
+    save("norm.npy", np.ascontiguousarray(norm, dtype=np.float32))
+    save("boost.npy", np.ascontiguousarray(boost, dtype=np.float64))
+    save("offsets.npy", offsets)
+    _write_atomic(out_dir / "strings.bin", lambda p: p.write_bytes(b"".join(chunks)))
+    if graph is not None:
+        save(GRAPH_NAME, np.ascontiguousarray(graph, dtype=np.int32))
+    quantized = quantized or {}
+    codes, series, tags, tag_rows, tag_offsets = _filter_arrays(chunks, len(records))
+    save("series_codes.npy", codes)
+    save("tag_rows.npy", tag_rows)
+    save("tag_offsets.npy", tag_offsets)
+    filters = {"series": series, "tags": tags}
+    _write_atomic(out_dir / FILTERS_NAME, lambda p: p.write_text(json.dumps(filters, ensure_ascii=False), encoding="utf-8"))
+    for dtype, arrays in quantized.items():
+        for part, arr in zip(QUANT_PARTS, arrays):
+            save(f"{dtype}_{part}.npy", np.ascontiguousarray(arr))
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "count": len(records),
+        "features": list(features),
+        "columns": COLUMNS,
+        "stats": stats,
+        "graph_k": int(graph.shape[1]) if graph is not None else None,
+        "quantized": sorted(quantized),
+        "filters": True,
+        "source_sha256": source_sha256,
+    }
+    _write_atomic(out_dir / META_NAME, lambda p: p.write_text(json.dumps(meta, indent=2), encoding="utf-8"))
+    return out_dir
+
+
+class CharacterTable(Sequence):
+    """Read-only list of character dicts backed by the mmapped catalog.
+    Rows are materialized on access, in the same shape as anime_vectors.json."""
+
+    def __init__(self, vectors, strings, offsets, features, columns):
+        self.vectors = vectors
+        self.strings = strings
+        self.offsets = offsets
+        self.features = features
+        self.columns = columns
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def _text(self, row: int, col: int) -> str:
+        i = row * len(self.columns) + col
+        return bytes(self.strings[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def column(self, name: str) -> list:
+        """Every value of one text column, without materializing the rows."""
+        col = self.columns.index(name)
+        starts = self.offsets[col:-1:len(self.columns)].tolist()
+        ends = self.offsets[col + 1::len(self.columns)].tolist()
+        # memoryview slices, not memmap indexing: numpy's per-item overhead dominates otherwise
+        blob = memoryview(self.strings)
+        return [str(blob[a:b], "utf-8") or None for a, b in zip(starts, ends)]
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        c = {}
+        for col, name in enumerate(self.columns):
+            text = self._text(row, col)
+            if name != "tags":
+                c[name] = text or None
+                continue
+            c[name] = json.loads(text)
+            # same field order as the JSON: vector sits between tags and image_url.
+            # features are stored rounded to 4 places, so rounding undoes the float32 cast
+            c["vector"] = {f: round(float(v), 4) for f, v in zip(self.features, self.vectors[row])}
+        return c
+
+
+class OverlayTable(Sequence):
+    """Rows of a base sequence (a CharacterTable or a list of dicts) after
+    edits, without copying the rows that did not change. `rows[i]` is the
+    base row behind row i, or ~j for the edited record `extra[j]`."""
+
+    def __init__(self, base, rows, extra):
+        self.base = base
+        self.rows = rows
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        src = int(self.rows[row])
+        return self.base[src] if src >= 0 else self.extra[~src]
+
+    def column(self, name: str) -> list:
+        """Every value of one text column, like CharacterTable.column."""
+        base = self.base.column(name) if hasattr(self.base, "column") else [c.get(name) for c in self.base]
+        return [base[src] if src >= 0 else self.extra[~src].get(name) for src in self.rows.tolist()]
+
+
+def read_meta(path: Path):
+    """The catalog's meta.json, or None if the directory is missing or from an
+    unsupported format version."""
+    try:
+        meta = json.loads((Path(path) / META_NAME).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    return meta if meta.get("format") == FORMAT_VERSION else None
+
+
+def open_catalog(path: Path, source_sha256: str = None):
+    """Open a catalog directory. Returns (table, stats, arrays) where arrays is
+    (vectors, norm, boost), or None if the directory is missing, from an
+    unsupported format version or, when `source_sha256` is given, compiled
+    from a different JSON."""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        return None
+    if source_sha256 is not None and meta.get("source_sha256") != source_sha256:
+        return None
+
+    vectors = np.load(path / "vectors.npy", mmap_mode="r")
+    norm = np.load(path / "norm.npy", mmap_mode="r")
+    boost = np.load(path / "boost.npy", mmap_mode="r")
+    offsets = np.load(path / "offsets.npy", mmap_mode="r")
+    strings = np.memmap(path / "strings.bin", dtype=np.uint8, mode="r") if offsets[-1] else np.zeros(0, np.uint8)
+    table = CharacterTable(vectors, strings, offsets, meta["features"], meta["columns"])
+    return table, meta["stats"], (vectors, norm, boost)
+
+
+def open_graph(path: Path):
+    """The catalog's (N, K) neighbour graph, mmapped, or None if it was written
+    without one."""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None or not meta.get("graph_k"):
+        return None
+    graph = np.load(path / GRAPH_NAME, mmap_mode="r")
+    if graph.shape != (meta["count"], meta["graph_k"]):
+        return None
+    return graph
+
+
+def open_quantized(path: Path, dtype: str):
+    """(codes, scale, sq_norms) of a quantized index written with the catalog,
+    codes and squared norms mmapped, or None if it has none for `dtype`."""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None or dtype not in meta.get("quantized", []):
+        return None
+    codes, scale, sq_norms = (np.load(path / f"{dtype}_{part}.npy", mmap_mode="r") for part in QUANT_PARTS)
+    if codes.shape != (meta["count"], len(meta["features"])) or sq_norms.shape != (meta["count"],):
+        return None
+    return codes, np.array(scale), sq_norms
+
+
+def open_filters(path: Path):
+    """(series codes, series name per code, {tag: sorted row ids}) written with
+    the catalog, the arrays mmapped, or None if it was written without them."""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None or not meta.get("filters"):
+        return None
+    codes = np.load(path / "series_codes.npy", mmap_mode="r")
+    if codes.shape != (meta["count"],):
+        return None
+    names = json.loads((path / FILTERS_NAME).read_text(encoding="utf-8"))
+    rows = np.load(path / "tag_rows.npy", mmap_mode="r")
+    offsets = np.load(path / "tag_offsets.npy").tolist()
+    tag_rows = {tag: rows[offsets[i]:offsets[i + 1]] for i, tag in enumerate(names["tags"])}
+    return codes, names["series"], tag_rows
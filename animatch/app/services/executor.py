@@ -0,0 +1,123 @@
+"""Process pool that keeps the CPU-bound image pipeline off the event loop."""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from animatch.app.services import landmarks as landmarks_service
+from animatch.app.services.features import landmarks_to_vector
+
+# 0 runs the pipeline on the default thread pool instead of worker processes
+POOL_WORKERS = int(os.environ.get("ANIMATCH_WORKERS", os.cpu_count() or 1))
+# requests allowed in flight (running + queued) before new ones get a 503
+MAX_PENDING = int(os.environ.get("ANIMATCH_MAX_PENDING", max(POOL_WORKERS, 1) * 4))
+
+
+class PoolOverloaded(Exception):
+    """Raised when the pipeline queue is full."""
+
+
+def _init_worker() -> None:
+    # every worker process holds its own preloaded FaceLandmarker
+    landmarks_service._get_landmarker()
+
+
+def _ping() -> None:
+    """No-op task used to start a worker (and its landmarker) ahead of traffic."""
+
+
+def extract_features(data: bytes, return_image: bool = False, image=None):
+    """Decode, quality checks, landmarks and features for one upload.
+    Returns (landmarks, quality, features, overlay_png); landmarks is the (478, 3)
+    float32 array from extract_landmarks, or None if no face, and features the
+    (F,) vector in schema.FEATURES order.
+    The upload is decoded once into an ImageContext (or `image` if given) that
+    the quality checks, detection and overlay all share."""
+    ctx = image if image is not None else landmarks_service.ImageContext.from_bytes(data)
+    landmarks, quality = landmarks_service.extract_landmarks(ctx)
+    if landmarks is None:
+        return None, quality, None, None
+    features = landmarks_to_vector(landmarks)
+    overlay = landmarks_service.draw_landmarks_on_image(ctx, landmarks) if return_image else None
+    return landmarks, quality, features, overlay
+
+
+class PipelinePool:
+    """Bounded front for a ProcessPoolExecutor sized to the machine's cores.
+    A worker that dies (e.g. a MediaPipe crash) breaks the whole executor, so
+    the pool is recreated and the request retried once."""
+
+    def __init__(self, workers: int = POOL_WORKERS, max_pending: int = MAX_PENDING) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self.workers > 0 and self._executor is None:
+            # spawn: forking a process that already runs MediaPipe threads is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+
+    async def warm(self) -> None:
+        """Spawn every worker and wait until each has loaded its landmarker, so
+        the first uploads do not pay for starting MediaPipe."""
+        self.start()
+        if self._executor is None:
+            return
+        # submitted back to back, each task starts its own worker process
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        # concurrent requests see the same broken executor; only the first replaces it
+        if self._executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.restarts += 1
+            self.start()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker; raises PoolOverloaded when max_pending is reached."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolOverloaded(f"{self.pending} requests already in flight")
+        self.start()
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        try:
+            executor = self._executor
+            try:
+                return await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                self._restart(executor)
+                return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
+
+
+pipeline_pool = PipelinePool()
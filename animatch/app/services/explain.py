@@ -1,3 +1,7 @@
+import numpy as np
+
+from animatch.app.services.schema import FEATURES
+
 feature_labels = {"face_ratio": "Close face proportions",
     "eye_spacing": "Similar eye spacing",
     "eye_openness": "Similar eye openness",
@@ -7,24 +11,22 @@ feature_labels = {"face_ratio": "Close face proportions",
 } # temp definition before langchain 
 
 
-def explain_match(user_vector:float, char_vector:float , max_response = 3):
-    differences = []
-    for key in user_vector:
-        # abs makes it positive so we only get [(0.01, "eye_spacing"), ...]
-        differences.append((abs(user_vector[key] - char_vector[key]), key))
+def explain_match(user_vector, char_vector, max_response = 3):
+    """Closest features first; vectors are dicts or arrays in FEATURES order."""
+    # abs makes it positive so we only get the size of each gap
+    differences = np.abs(FEATURES.row(user_vector) - FEATURES.row(char_vector))
 
-    # Sort by smallest difference first
-    differences.sort(key=lambda x: x[0])
+    # Sort by smallest difference first, ties in schema order
+    order = np.argsort(differences, kind="stable")
 
     reasons = []
-    for diff, key in differences[:max_response]:
+    for col in order[:max_response]:
+        key = FEATURES.names[col]
         label = feature_labels.get(key, f"Similar {key}")
         reasons.append({
             "feature": key,
             "reason": label,
-            "difference": round(float(diff), 4),
+            "difference": round(float(differences[col]), 4),
         })
 
     return reasons
-
-        
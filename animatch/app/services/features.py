@@ -1,6 +1,8 @@
 import numpy as np
 import math
 
+from animatch.app.services.schema import FEATURES
+
 LEFT_EYE_INNER = 133
 RIGHT_EYE_INNER = 362
 
@@ -47,102 +49,97 @@ def angle_at_point(a, b, c):
 
 
 
-def landmarks_to_features(landmarks):
-    pts = np.array(landmarks, dtype=np.float32)  # shape: (N, 3)
-
-    xs = pts[:, 0]
-    ys = pts[:, 1]
-
-    face_width = float(xs.max() - xs.min())
-    face_height = float(ys.max() - ys.min())
-
-    
-    if face_width == 0: #prevents dividing by 0
-        face_width = 1e-6
-    if face_height == 0: 
-        face_height = 1e-6
-
-    face_ratio = face_width / face_height
-    left_inner = pts[LEFT_EYE_INNER]
-    right_inner = pts[RIGHT_EYE_INNER]
-
-    eye_spacing_raw = dist2d(left_inner, right_inner)
-    eye_spacing = eye_spacing_raw / face_width #computes and normalizes eye distance
-    """computes eye openess and converts geenral points to landmarks """
-    left_outer = pts[LEFT_EYE_OUTER] 
-    right_outer = pts[RIGHT_EYE_OUTER]
+def _dist2d(a, b):
+    """Row-wise dist2d for (B, 3) float32 points; squares summed in float32 like dist2d."""
+    dx = a[:, 0] - b[:, 0]
+    dy = a[:, 1] - b[:, 1]
+    return np.sqrt((dx * dx + dy * dy).astype(np.float64))
 
-    left_upper = pts[LEFT_UPPER_LID]
-    left_lower = pts[LEFT_LOWER_LID]
-    right_upper = pts[RIGHT_UPPER_LID]
-    right_lower = pts[RIGHT_LOWER_LID]
 
-    left_eye_height = dist2d(left_upper, left_lower) #computes eye measurements 
-    right_eye_height = dist2d(right_upper, right_lower)
-    left_eye_width = dist2d(left_inner, left_outer)
-    right_eye_width = dist2d(right_inner, right_outer)
+def _nonzero(v):
+    return np.where(v == 0, 1e-6, v)
 
-    if left_eye_width == 0: #prevents dividing by 0
-        left_eye_width = 1e-6
-    if right_eye_width == 0:
-        right_eye_width = 1e-6
 
+def landmarks_to_feature_matrix(landmarks, decimals=4):
+    """Batched landmarks_to_features: (B, 478, 3) landmarks -> (B, 8) float64
+    features in FEATURES order, all vectorized over the batch.
+    Rounded with np.round to `decimals` places (None leaves them unrounded)."""
+    pts = np.asarray(landmarks, dtype=np.float32)
+    if pts.ndim == 2:
+        pts = pts[None]
+    b = np.arange(pts.shape[0])
 
-    left_open = left_eye_height / left_eye_width #openness ratio
-    right_open = right_eye_height / right_eye_width
+    xs = pts[:, :, 0]
+    ys = pts[:, :, 1]
 
-    eye_openness = (left_open + right_open) / 2    #avrages
-    chin = pts[ys.argmax()] # chin = lowest point (max y)
-
-    # bottom region = last 15% of face height
-    y_cut = ys.min() + 0.85 * face_height
-    bottom_pts = pts[ys >= y_cut]
-
-    # fallback
-    if len(bottom_pts) < 5:
-        bottom_pts = pts
-
-    jaw_left = bottom_pts[bottom_pts[:, 0].argmin()]
-    jaw_right = bottom_pts[bottom_pts[:, 0].argmax()]
-
-    jaw_angle_rad = angle_at_point(jaw_left, chin, jaw_right)
-    jaw_angle = jaw_angle_rad / math.pi  # normalize by dividing by pi
+    face_width = _nonzero((xs.max(axis=1) - xs.min(axis=1)).astype(np.float64))  #prevents dividing by 0
+    face_height = _nonzero((ys.max(axis=1) - ys.min(axis=1)).astype(np.float64))
+    face_ratio = face_width / face_height
 
+    left_inner = pts[:, LEFT_EYE_INNER]
+    right_inner = pts[:, RIGHT_EYE_INNER]
+    eye_spacing = _dist2d(left_inner, right_inner) / face_width
+
+    left_eye_height = _dist2d(pts[:, LEFT_UPPER_LID], pts[:, LEFT_LOWER_LID])
+    right_eye_height = _dist2d(pts[:, RIGHT_UPPER_LID], pts[:, RIGHT_LOWER_LID])
+    left_eye_width = _nonzero(_dist2d(left_inner, pts[:, LEFT_EYE_OUTER]))
+    right_eye_width = _nonzero(_dist2d(right_inner, pts[:, RIGHT_EYE_OUTER]))
+    eye_openness = (left_eye_height / left_eye_width + right_eye_height / right_eye_width) / 2
+
+    chin = pts[b, ys.argmax(axis=1)]  # chin = lowest point (max y)
+
+    # bottom region = last 15% of face height, all points if that has fewer than 5
+    y_cut = ys.min(axis=1) + (0.85 * face_height).astype(np.float32)
+    bottom = ys >= y_cut[:, None]
+    bottom[bottom.sum(axis=1) < 5] = True
+    jaw_left = pts[b, np.where(bottom, xs, np.inf).argmin(axis=1)]
+    jaw_right = pts[b, np.where(bottom, xs, -np.inf).argmax(axis=1)]
+
+    # same vectors as angle_at_point(jaw_left, chin, jaw_right)
+    ba = jaw_left[:, :2] - chin[:, :2]
+    bc = jaw_left[:, :2] - jaw_right[:, :2]
+    dot = (ba[:, 0] * bc[:, 0] + ba[:, 1] * bc[:, 1]).astype(np.float64)
+    mag_ba = np.sqrt((ba[:, 0] * ba[:, 0] + ba[:, 1] * ba[:, 1]).astype(np.float64))
+    mag_bc = np.sqrt((bc[:, 0] * bc[:, 0] + bc[:, 1] * bc[:, 1]).astype(np.float64))
+    degenerate = (mag_ba == 0) | (mag_bc == 0)
+    cos = np.clip(dot / np.where(degenerate, 1.0, mag_ba * mag_bc), -1, 1)
+    jaw_angle = np.where(degenerate, 0.0, np.arccos(cos)) / math.pi
+
+    chin_ratio = (jaw_right[:, 0] - jaw_left[:, 0]).astype(np.float64) / face_width
+
+    def brow_y(idx):
+        total = pts[:, idx[0], 1]
+        for i in idx[1:]:
+            total = total + pts[:, i, 1]
+        return (total / np.float32(len(idx))).astype(np.float64)
+
+    left_gap = (pts[:, LEFT_UPPER_LID, 1].astype(np.float64) - brow_y(LEFT_BROW)) / face_height
+    right_gap = (pts[:, RIGHT_UPPER_LID, 1].astype(np.float64) - brow_y(RIGHT_BROW)) / face_height
+    brow_height = (left_gap + right_gap) / 2
 
-    chin_width = float(jaw_right[0] - jaw_left[0])
-    chin_ratio = chin_width/face_width
+    mouth_width = _dist2d(pts[:, MOUTH_LEFT], pts[:, MOUTH_RIGHT]) / face_width
+    nose_length = _dist2d(pts[:, NOSE_TIP], pts[:, NOSE_BRIDGE]) / face_height
 
-    left_brow_y = float(np.mean([pts[i][1] for i in LEFT_BROW]))
-    right_brow_y = float(np.mean([pts[i][1] for i in RIGHT_BROW]))
+    columns = {
+        "face_ratio": face_ratio,
+        "eye_spacing": eye_spacing,
+        "eye_openness": eye_openness,
+        "jaw_angle": jaw_angle,
+        "chin_ratio": chin_ratio,
+        "brow_height": brow_height,
+        "mouth_width": mouth_width,
+        "nose_length": nose_length,
+    }
+    out = np.stack([columns[f] for f in FEATURES.names], axis=1)
+    return out if decimals is None else np.round(out, decimals)
 
-    left_lid_y = float(pts[LEFT_UPPER_LID][1])
-    right_lid_y = float(pts[RIGHT_UPPER_LID][1])
 
-    left_gap = (left_lid_y - left_brow_y) / face_height
-    right_gap = (right_lid_y - right_brow_y) / face_height
+def landmarks_to_vector(landmarks):
+    """(F,) feature vector for one face in FEATURES order, rounded to 4 places."""
+    row = landmarks_to_feature_matrix([landmarks], decimals=None)[0]
+    return np.array([round(v, 4) for v in row.tolist()])
 
-    brow_height = (left_gap + right_gap) / 2
 
-    mouth_left = pts[MOUTH_LEFT]
-    mouth_right = pts[MOUTH_RIGHT]
-    mouth_width_raw = dist2d(mouth_left, mouth_right)
-    if face_width == 0:
-        face_width = 1e-6
-    mouth_width = mouth_width_raw / face_width
-
-    nose_tip = pts[NOSE_TIP]
-    nose_bridge = pts[NOSE_BRIDGE]
-    nose_len_raw = dist2d(nose_tip, nose_bridge)
-    nose_length = nose_len_raw / face_height
-
-
-    return {
-    "face_ratio": round(face_ratio, 4),
-    "eye_spacing": round(eye_spacing, 4),
-    "eye_openness": round(eye_openness, 4),
-    "jaw_angle": round(jaw_angle, 4),
-    "chin_ratio": round(chin_ratio, 4),
-    "brow_height": round(brow_height, 4),
-    "mouth_width": round(mouth_width, 4),
-    "nose_length": round(nose_length, 4),
-}
+def landmarks_to_features(landmarks):
+    """Feature dict for one face, as stored in anime_vectors.json."""
+    return FEATURES.as_dict(landmarks_to_vector(landmarks))
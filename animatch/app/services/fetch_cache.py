@@ -0,0 +1,214 @@
+"""Content-addressed on-disk cache for the dataset scripts' HTTP fetches.
+
+Bodies are stored once per content hash under blobs/, and an SQLite index maps
+each URL (with its query string) to the hash plus the ETag/Last-Modified the
+server sent. Entries younger than `ttl` are served without touching the
+network; older ones are revalidated with a conditional GET, so an unchanged
+image or Jikan page costs one 304. Least recently used blobs are evicted once
+the cache grows past `max_bytes`. In offline mode only the cache is used.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+CACHE_DIR = Path(os.environ.get("ANIMATCH_FETCH_CACHE_DIR") or Path(__file__).resolve().parents[2] / "data" / "fetch_cache")
+CACHE_MB = int(os.environ.get("ANIMATCH_FETCH_CACHE_MB", "2048"))
+# seconds an entry is served without revalidation
+CACHE_TTL = float(os.environ.get("ANIMATCH_FETCH_CACHE_TTL", str(7 * 24 * 3600)))
+# serve only from the cache, never touch the network
+OFFLINE = os.environ.get("ANIMATCH_OFFLINE", "0") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+"""
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode for a URL that is not in the cache."""
+
+
+class Cancelled(Exception):
+    """Raised when a fetch's `cancel` event is set mid-download."""
+
+
+def cache_key(url: str, params: Optional[dict] = None) -> str:
+    """The full request URL, so the same query with different params gets its own entry."""
+    if not params:
+        return url
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+class FetchCache:
+    """HTTP GETs through a content-addressed cache. Safe to share between
+    threads; several processes can share one directory (SQLite WAL)."""
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = CACHE_MB * 1024 * 1024,
+                 ttl: float = CACHE_TTL, offline: bool = OFFLINE) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.root / "index.sqlite", check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.network_bytes = 0
+        self._evict()  # a lowered max_bytes applies right away
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    def _lookup(self, key: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT hash, etag, last_modified, fetched_at FROM urls WHERE url = ?", (key,)
+            ).fetchone()
+
+    def _read_blob(self, digest: str) -> Optional[bytes]:
+        try:
+            data = self._blob_path(digest).read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._db.execute("UPDATE blobs SET used_at = ? WHERE hash = ?", (time.time(), digest))
+            self._db.commit()
+        return data
+
+    def _store(self, key: str, data: bytes, etag: Optional[str], last_modified: Optional[str]) -> None:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_name(f"{digest}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (hash, size, used_at) VALUES (?, ?, ?)", (digest, len(data), now)
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, hash, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, digest, etag, last_modified, now),
+            )
+            self._db.commit()
+        self._evict()
+
+    def _touch(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE urls SET fetched_at = ? WHERE url = ?", (time.time(), key))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used blobs (and the URLs pointing at them) down to 90% of max_bytes."""
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for digest, size in self._db.execute("SELECT hash, size FROM blobs ORDER BY used_at"):
+                if total <= self.max_bytes * 0.9:
+                    break
+                victims.append(digest)
+                total -= size
+            self._db.executemany("DELETE FROM urls WHERE hash = ?", [(d,) for d in victims])
+            self._db.executemany("DELETE FROM blobs WHERE hash = ?", [(d,) for d in victims])
+            self._db.commit()
+        for digest in victims:
+            self._blob_path(digest).unlink(missing_ok=True)
+        self.evictions += len(victims)
+
+    def get(self, url: str, params: Optional[dict] = None, session=None, timeout: float = 20,
+            throttle=None, slot=None, cancel: Optional[threading.Event] = None) -> bytes:
+        """Body of GET `url`, from the cache when possible.
+
+        `throttle()` is called before each network request (e.g. a rate
+        limiter's acquire), `slot` is a context manager held while the network
+        request runs (e.g. a semaphore) and `cancel` aborts a streamed download
+        with Cancelled. HTTP errors raise requests.HTTPError as usual; offline
+        misses raise CacheMiss."""
+        key = cache_key(url, params)
+        entry = self._lookup(key)
+        cached = self._read_blob(entry[0]) if entry else None
+        if cached is not None and (self.offline or time.time() - entry[3] < self.ttl):
+            self.hits += 1
+            return cached
+        if self.offline:
+            raise CacheMiss(key)
+
+        headers = {}
+        if cached is not None:
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+        if throttle is not None:
+            throttle()
+        session = session or requests
+        with slot if slot is not None else nullcontext():
+            if cancel is not None and cancel.is_set():
+                raise Cancelled(key)
+            with session.get(url, params=params, headers=headers, timeout=timeout, stream=cancel is not None) as r:
+                if r.status_code == 304 and cached is not None:
+                    self._touch(key)
+                    self.revalidated += 1
+                    return cached
+                r.raise_for_status()
+                if cancel is None:
+                    data = r.content
+                else:
+                    chunks = []
+                    for chunk in r.iter_content(64 * 1024):
+                        if cancel.is_set():
+                            raise Cancelled(key)
+                        chunks.append(chunk)
+                    data = b"".join(chunks)
+                etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        self.misses += 1
+        self.network_bytes += len(data)
+        self._store(key, data, etag, last_modified)
+        return data
+
+    def get_json(self, url: str, params: Optional[dict] = None, **kwargs):
+        return json.loads(self.get(url, params=params, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "blobs": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "network_bytes": self.network_bytes,
+        }
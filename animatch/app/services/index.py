@@ -0,0 +1,304 @@
+"""Nearest-neighbour indexes over the z-scored catalog matrix.
+
+Every index ranks rows by the boosted similarity match_characters uses,
+boost / (1 + distance), and returns the best k rows plus any row within
+`slack` of the k-th score so the caller can rerank near-ties exactly.
+"""
+import math
+
+import numpy as np
+
+
+def boosted_scores(norm, boost, query):
+    """Boosted similarity of every row of `norm` to one z-scored query."""
+    diff = norm - query
+    return boost / (1.0 + np.sqrt(np.einsum("ij,ij->i", diff, diff)))
+
+
+def top_rows(rows, scores, k, slack):
+    """Rows scoring within `slack` of the k-th best, best first."""
+    if len(rows) > k:
+        cut = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= cut - slack
+        rows, scores = rows[keep], scores[keep]
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
+
+
+class ExactIndex:
+    """Brute-force scan of the whole matrix."""
+
+    name = "exact"
+
+    def __init__(self, norm, boost):
+        self.norm = norm
+        self.boost = boost.astype(np.float32)
+
+    def __len__(self):
+        return self.norm.shape[0]
+
+    def search(self, query, k, slack=0.0):
+        scores = boosted_scores(self.norm, self.boost, query)
+        return top_rows(np.arange(len(self)), scores, k, slack)
+
+
+class KDTreeIndex:
+    """Exact KD-tree. Only the leaves are kept: each is a contiguous slice of
+    the permuted matrix with its bounding box and largest boost. A query bounds
+    every leaf at once (largest boost over the distance to the box), then scans
+    leaves best bound first in growing batches with one vectorized pass each,
+    and stops once no unscanned leaf can beat the current k-th score."""
+
+    name = "kdtree"
+
+    def __init__(self, norm, boost, leaf_size=64):
+        self.leaf_size = leaf_size
+        n = norm.shape[0]
+        self.perm = np.arange(n)
+        self._leaves = []  # (start, end) of every leaf
+        self._norm_src = norm
+        if n:
+            self._build(0, n)
+        del self._norm_src
+        # leaves are contiguous slices of the permuted matrix
+        self.norm = np.ascontiguousarray(norm[self.perm])
+        self.boost = boost.astype(np.float32)[self.perm]
+        bounds = np.array(self._leaves, dtype=np.intp).reshape(-1, 2)
+        self.starts, self.sizes = bounds[:, 0], bounds[:, 1] - bounds[:, 0]
+        self.lo = np.array([self.norm[a:b].min(axis=0) for a, b in self._leaves], dtype=np.float32).reshape(-1, norm.shape[1])
+        self.hi = np.array([self.norm[a:b].max(axis=0) for a, b in self._leaves], dtype=np.float32).reshape(-1, norm.shape[1])
+        self.max_boost = np.array([self.boost[a:b].max() for a, b in self._leaves], dtype=np.float32)
+        del self._leaves
+
+    def __len__(self):
+        return self.perm.shape[0]
+
+    def _build(self, start, end):
+        if end - start > self.leaf_size:
+            rows = self.perm[start:end]
+            pts = self._norm_src[rows]
+            spread = pts.max(axis=0) - pts.min(axis=0)
+            dim = int(np.argmax(spread))
+            if spread[dim] > 0:
+                mid = (end - start) // 2
+                self.perm[start:end] = rows[np.argpartition(pts[:, dim], mid)]
+                self._build(start, start + mid)
+                self._build(start + mid, end)
+                return
+        self._leaves.append((start, end))
+
+    def _rows(self, leaves):
+        """Permuted row ids of the given leaves, concatenated without a Python loop."""
+        sizes = self.sizes[leaves]
+        offsets = np.repeat(self.starts[leaves] - (np.cumsum(sizes) - sizes), sizes)
+        return offsets + np.arange(int(sizes.sum()))
+
+    def search(self, query, k, slack=0.0):
+        k = min(k, len(self))
+        if k <= 0:
+            return np.arange(0), np.zeros(0, dtype=np.float32)
+        gap = np.maximum(np.maximum(self.lo - query, query - self.hi), 0.0)
+        bounds = self.max_boost / (1.0 + np.sqrt(np.einsum("ij,ij->i", gap, gap)))
+        order = np.argsort(-bounds, kind="stable")
+        hit_rows, hit_scores = [], []
+        best = np.zeros(0, dtype=np.float32)  # current top-k scores
+        pos = 0
+        batch = max(1, -(-2 * k // self.leaf_size))
+        while pos < len(order):
+            if best.shape[0] >= k and bounds[order[pos]] < best.min() - slack:
+                break
+            leaves = order[pos:pos + batch]
+            pos += len(leaves)
+            batch *= 2
+            rows = self._rows(leaves)
+            scores = boosted_scores(self.norm[rows], self.boost[rows], query)
+            hit_rows.append(rows)
+            hit_scores.append(scores)
+            best = np.concatenate([best, scores])
+            if best.shape[0] > k:
+                best = np.partition(best, best.shape[0] - k)[-k:]
+        rows, scores = top_rows(np.concatenate(hit_rows), np.concatenate(hit_scores), k, slack)
+        return self.perm[rows], scores
+
+
+class IVFIndex:
+    """Approximate inverted-file index: rows are clustered with k-means and a
+    query only scans the `nprobe` lists whose centroids are closest to it."""
+
+    name = "ivf"
+
+    def __init__(self, norm, boost, nlist=None, nprobe=8, iters=20, seed=0, centroids=None):
+        n = norm.shape[0]
+        self.nprobe = nprobe
+        if centroids is not None:
+            # reuse trained centroids (see update_index); rows are only reassigned
+            self.nlist = centroids.shape[0]
+            self.centroids = centroids.astype(np.float32)
+            assign = _nearest_centroid(norm, self.centroids)
+        else:
+            if nlist is None:
+                nlist = int(math.sqrt(n))
+            self.nlist = max(1, min(nlist, n))
+            self.centroids, assign = _kmeans(norm, self.nlist, iters, seed)
+        self.perm = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.perm], np.arange(self.nlist + 1))
+        self.norm = np.ascontiguousarray(norm[self.perm])
+        self.boost = boost.astype(np.float32)[self.perm]
+
+    def __len__(self):
+        return self.perm.shape[0]
+
+    def search(self, query, k, slack=0.0):
+        diff = self.centroids - query
+        probe = np.argsort(np.einsum("ij,ij->i", diff, diff))[: max(1, self.nprobe)]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        scores = boosted_scores(self.norm[rows], self.boost[rows], query)
+        rows, scores = top_rows(rows, scores, k, slack)
+        return self.perm[rows], scores
+
+
+def quantize(norm, dtype="int8", chunk=65536):
+    """(codes, scale, sq_norms) that QuantizedIndex scans for a z-scored
+    matrix, encoded in row chunks so `norm` can be an mmap."""
+    if dtype == "int8":
+        peak = np.abs(norm).max(axis=0) if norm.shape[0] else np.ones(norm.shape[1])
+        scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.empty(norm.shape, dtype=np.int8)
+        for start in range(0, norm.shape[0], chunk):
+            block = np.asarray(norm[start:start + chunk], dtype=np.float32) / scale
+            codes[start:start + chunk] = np.clip(np.rint(block), -127, 127)
+    elif dtype == "float16":
+        scale = np.ones(norm.shape[1], dtype=np.float32)
+        codes = np.asarray(norm, dtype=np.float16)
+    else:
+        raise ValueError(f"Unknown quantized dtype {dtype!r}. Use int8 or float16.")
+    sq_norms = np.empty(norm.shape[0], dtype=np.float32)
+    for start in range(0, norm.shape[0], chunk):
+        block = codes[start:start + chunk].astype(np.float32) * scale
+        sq_norms[start:start + chunk] = np.einsum("ij,ij->i", block, block)
+    return codes, scale, sq_norms
+
+
+class QuantizedIndex:
+    """Scan over a quantized copy of the matrix, then rerank in float32.
+    int8 stores each feature as round(z / scale) with a per-feature scale
+    (max |z| / 127); float16 is a plain half-precision copy. The first pass
+    scores every row from the small copy as |z|^2 - 2 z.q + |q|^2, with the
+    dequantized |z|^2 kept per row, and the best k + rerank rows are then
+    rescored exactly from `norm`, which is only read for those rows.
+    `quantized` takes precomputed (codes, scale, sq_norms), e.g. the ones
+    mmapped from the compiled catalog; without it they are computed here,
+    which reads all of `norm`."""
+
+    quantized = True
+
+    def __init__(self, norm, boost, dtype="int8", rerank=256, chunk=65536, quantized=None):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unknown quantized dtype {dtype!r}. Use int8 or float16.")
+        self.name = dtype
+        self.rerank = rerank
+        self.chunk = chunk
+        self.norm = norm
+        self.boost = boost.astype(np.float32)
+        self.codes, self.scale, self.sq_norms = quantized if quantized is not None else quantize(norm, dtype, chunk)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.sq_norms.nbytes + self.boost.nbytes
+
+    def _approx_scores(self, query):
+        query = np.asarray(query, dtype=np.float32)
+        weights = self.scale * query
+        q_sq = np.float32(query @ query)
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.chunk):
+            end = start + self.chunk
+            d2 = self.sq_norms[start:end] - 2.0 * (self.codes[start:end].astype(np.float32) @ weights) + q_sq
+            np.maximum(d2, 0.0, out=d2)
+            np.sqrt(d2, out=d2)
+            d2 += 1.0
+            out[start:end] = self.boost[start:end] / d2
+        return out
+
+    def search(self, query, k, slack=0.0):
+        n = len(self)
+        approx = self._approx_scores(query)
+        cand = min(n, k + self.rerank)
+        rows = np.arange(n)
+        if cand < n:
+            # sorted so the float32 rows are read in storage order
+            rows = np.sort(np.argpartition(approx, n - cand)[n - cand:])
+        scores = boosted_scores(np.asarray(self.norm[rows], dtype=np.float32), self.boost[rows], query)
+        return top_rows(rows, scores, k, slack)
+
+
+def _nearest_centroid(points, centroids, chunk=65536):
+    """Index of the closest centroid for every point, in bounded-size chunks."""
+    out = np.empty(points.shape[0], dtype=np.intp)
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2; |p|^2 is the same for every centroid
+    c2 = (centroids * centroids).sum(axis=1)
+    for start in range(0, points.shape[0], chunk):
+        block = points[start:start + chunk]
+        out[start:start + chunk] = (c2 - 2.0 * block @ centroids.T).argmin(axis=1)
+    return out
+
+
+def _kmeans(points, nlist, iters, seed):
+    """Plain Lloyd's k-means; returns (centroids, assignment)."""
+    n, dim = points.shape
+    if n == 0:
+        return np.zeros((nlist, dim), dtype=np.float32), np.zeros(0, dtype=np.intp)
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(n, size=nlist, replace=False)].astype(np.float32)
+    assign = None
+    for _ in range(iters):
+        new_assign = _nearest_centroid(points, centroids)
+        if assign is not None and np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        for d in range(dim):
+            sums = np.bincount(assign, weights=points[:, d], minlength=nlist)
+            centroids[filled, d] = sums[filled] / counts[filled]
+    return centroids, assign
+
+
+BACKENDS = {
+    "exact": ExactIndex,
+    "kdtree": KDTreeIndex,
+    "ivf": IVFIndex,
+    "int8": lambda norm, boost, **params: QuantizedIndex(norm, boost, dtype="int8", **params),
+    "float16": lambda norm, boost, **params: QuantizedIndex(norm, boost, dtype="float16", **params),
+}
+
+
+def update_index(index, norm, boost, scale=None, shift=None):
+    """Index of the same kind and settings as `index` over an edited catalog.
+    IVF keeps its trained centroids, mapped through z * scale + shift when the
+    z-scoring stats moved, and only reassigns rows instead of rerunning k-means;
+    the exact and KD-tree indexes are rebuilt (both are cheap to build)."""
+    if isinstance(index, IVFIndex) and norm.shape[0] >= index.nlist:
+        centroids = index.centroids.astype(np.float64)
+        if scale is not None:
+            centroids = centroids * scale + shift
+        return IVFIndex(norm, boost, nprobe=index.nprobe, centroids=centroids)
+    if isinstance(index, KDTreeIndex):
+        return KDTreeIndex(norm, boost, leaf_size=index.leaf_size)
+    if isinstance(index, IVFIndex):
+        return IVFIndex(norm, boost, nprobe=index.nprobe)
+    if isinstance(index, QuantizedIndex):
+        return QuantizedIndex(norm, boost, dtype=index.name, rerank=index.rerank, chunk=index.chunk)
+    return type(index)(norm, boost)
+
+
+def build_index(backend, norm, boost, **params):
+    """Build the named index over a z-scored float32 matrix and boost column."""
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown index backend {backend!r}. Use one of: {', '.join(BACKENDS)}")
+    return cls(norm, boost, **params)
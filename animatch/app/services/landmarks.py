@@ -1,6 +1,10 @@
 import math
+import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Union
 
 import cv2
 import numpy as np
@@ -16,7 +20,11 @@ MODEL_URL = (
 )
 MODEL_PATH = Path(__file__).resolve().parents[1] / "models" / "face_landmarker.task"
 
-_landmarker: Optional[vision.FaceLandmarker] = None
+# most landmarkers alive at once; each one is a separate MediaPipe graph
+LANDMARKER_POOL_SIZE = int(os.environ.get("ANIMATCH_LANDMARKER_POOL", min(4, os.cpu_count() or 1)))
+_MODEL_LOCK = threading.Lock()  # one download of the model file at a time
+# longest side of the working image; bigger uploads are downscaled while decoding
+MAX_DECODE_DIM = int(os.environ.get("ANIMATCH_MAX_DIM", "1280"))
 
 
 def _ensure_model(path: Path = MODEL_PATH) -> Path:
@@ -32,29 +40,168 @@ def _ensure_model(path: Path = MODEL_PATH) -> Path:
     return path
 
 
-def _get_landmarker() -> vision.FaceLandmarker:
-    global _landmarker
-    if _landmarker is None:
+def _create_landmarker() -> vision.FaceLandmarker:
+    with _MODEL_LOCK:
         model_path = _ensure_model()
-        base_options = python.BaseOptions(model_asset_path=str(model_path))
-        options = vision.FaceLandmarkerOptions(
-            base_options=base_options,
-            running_mode=vision.RunningMode.IMAGE,
-            num_faces=1,
-            min_face_detection_confidence=0.5,
-            min_face_presence_confidence=0.5,
-            output_face_blendshapes=False,
-            output_facial_transformation_matrixes=False,
-        )
-        _landmarker = vision.FaceLandmarker.create_from_options(options)
-    return _landmarker
-
-
-def decode_image(image_bytes: bytes) -> np.ndarray:
+    base_options = python.BaseOptions(model_asset_path=str(model_path))
+    options = vision.FaceLandmarkerOptions(
+        base_options=base_options,
+        running_mode=vision.RunningMode.IMAGE,
+        num_faces=1,
+        min_face_detection_confidence=0.5,
+        min_face_presence_confidence=0.5,
+        output_face_blendshapes=False,
+        output_facial_transformation_matrixes=False,
+    )
+    return vision.FaceLandmarker.create_from_options(options)
+
+
+class LandmarkerPool:
+    """Sized pool of FaceLandmarker instances with checkout/checkin.
+    A landmarker is only used by one thread at a time; new ones are created lazily
+    until max_size, after which callers wait for a checkin."""
+
+    def __init__(self, max_size: int = LANDMARKER_POOL_SIZE, factory=_create_landmarker) -> None:
+        self.max_size = max(1, max_size)
+        self.factory = factory
+        self._idle: List[vision.FaceLandmarker] = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, timeout: Optional[float] = None) -> vision.FaceLandmarker:
+        start = time.perf_counter()
+        blocked = False
+        with self._cond:
+            while not self._idle and self._created >= self.max_size:
+                blocked = True
+                if not self._cond.wait(timeout):
+                    raise TimeoutError("No face landmarker available")
+            if self._idle:
+                lm = self._idle.pop()
+                create = False
+            else:
+                # reserve the slot, build the graph outside the lock
+                self._created += 1
+                create = True
+        if create:
+            try:
+                lm = self.factory()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+        waited = time.perf_counter() - start
+        with self._cond:
+            self.checkouts += 1
+            self.waits += blocked
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return lm
+
+    def release(self, lm: vision.FaceLandmarker) -> None:
+        with self._cond:
+            self._idle.append(lm)
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        lm = self.acquire(timeout)
+        try:
+            yield lm
+        finally:
+            self.release(lm)
+
+    def warm(self, count: int = 1) -> None:
+        """Create landmarkers up front so the first requests don't pay for it."""
+        held = [self.acquire() for _ in range(min(count, self.max_size))]
+        for lm in held:
+            self.release(lm)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._created,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._created - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_avg_ms": round(1000.0 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(1000.0 * self.wait_max, 3),
+            }
+
+
+landmarker_pool = LandmarkerPool()
+
+
+def _get_landmarker() -> vision.FaceLandmarker:
+    """Preload: make sure the pool holds at least one landmarker and return it.
+    Detection should go through landmarker_pool.checkout() instead."""
+    lm = landmarker_pool.acquire()
+    landmarker_pool.release(lm)
+    return lm
+
+
+def image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) read from a JPEG or PNG header without decoding, else None."""
+    if image_bytes[:8] == b"\x89PNG\r\n\x1a\n" and len(image_bytes) >= 24:
+        return int.from_bytes(image_bytes[16:20], "big"), int.from_bytes(image_bytes[20:24], "big")
+    if image_bytes[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    n = len(image_bytes)
+    while i + 9 < n:
+        if image_bytes[i] != 0xFF:
+            i += 1
+            continue
+        marker = image_bytes[i + 1]
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 1 if marker == 0xFF else 2  # fill byte / markers without a length
+            continue
+        # SOFn frame headers carry the size; C4/C8/CC are DHT/JPG/DAC, not frames
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = int.from_bytes(image_bytes[i + 5:i + 7], "big")
+            w = int.from_bytes(image_bytes[i + 7:i + 9], "big")
+            return w, h
+        i += 2 + int.from_bytes(image_bytes[i + 2:i + 4], "big")
+    return None
+
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def decode_image(image_bytes: bytes, max_dim: Optional[int] = None) -> np.ndarray:
+    """Decode to BGR. With max_dim, the longest side is capped at max_dim: JPEGs
+    are decoded at 1/2, 1/4 or 1/8 scale by libjpeg when that still leaves at least
+    max_dim pixels, and whatever remains over the cap is resized down."""
     arr = np.frombuffer(image_bytes, dtype=np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    img = None
+    if max_dim:
+        size = image_size(image_bytes)
+        if size is not None and image_bytes[:2] == b"\xff\xd8":
+            longest = max(size)
+            for factor, flag in _REDUCED_FLAGS:
+                if longest // factor >= max_dim:
+                    img = cv2.imdecode(arr, flag)
+                    break
+    if img is None:
+        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if img is None:
         raise ValueError("Could not decode image. Unsupported format or corrupted bytes.")
+    if max_dim:
+        h, w = img.shape[:2]
+        if max(h, w) > max_dim:
+            scale = max_dim / float(max(h, w))
+            img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
     return img
 
 
@@ -76,31 +223,87 @@ def maybe_resize(img: np.ndarray, target_min: int = 480, max_dim: int = 1280) ->
     return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
 
 
-def get_brightness(img: np.ndarray) -> float:
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    return float(np.mean(gray))
+class ImageContext:
+    """One decoded upload and the buffers derived from it, each computed once.
+    `original` is the image as decoded (at most max_dim on its longest side, used
+    for the overlay), `bgr` the working copy after maybe_resize (used for quality
+    checks and detection). Landmarks are normalized, so they fit both."""
+
+    def __init__(self, original: np.ndarray) -> None:
+        self.original = original
+        self.bgr = maybe_resize(original)
+        self._gray: Optional[np.ndarray] = None
+        self._rgb: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes, max_dim: Optional[int] = MAX_DECODE_DIM) -> "ImageContext":
+        return cls(decode_image(image_bytes, max_dim=max_dim))
+
+    @property
+    def width(self) -> int:
+        return self.bgr.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.bgr.shape[0]
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+
+ImageInput = Union[bytes, ImageContext]
+
+
+def as_image_context(image: ImageInput) -> ImageContext:
+    return image if isinstance(image, ImageContext) else ImageContext.from_bytes(image)
+
+
+def _gray(img: Union[np.ndarray, ImageContext]) -> np.ndarray:
+    if isinstance(img, ImageContext):
+        return img.gray
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def get_brightness(img: Union[np.ndarray, ImageContext]) -> float:
+    return float(np.mean(_gray(img)))
+
+
+def get_blur_score(img: Union[np.ndarray, ImageContext]) -> float:
+    return float(cv2.Laplacian(_gray(img), cv2.CV_64F).var())
 
 
-def get_blur_score(img: np.ndarray) -> float:
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+def landmarks_array(lms) -> np.ndarray:
+    """MediaPipe landmark list -> (N, 3) float32 array of normalized (x, y, z)."""
+    flat = np.fromiter((v for p in lms for v in (p.x, p.y, p.z)), dtype=np.float32, count=3 * len(lms))
+    return flat.reshape(-1, 3)
 
 
-def face_size_ok(landmarks: List[Tuple[float, float, float]], width: int, height: int, min_ratio: float = 0.15) -> bool:
-    xs = [p[0] * width for p in landmarks]
-    ys = [p[1] * height for p in landmarks]
-    w = max(xs) - min(xs)
-    h = max(ys) - min(ys)
-    return (w / width) >= min_ratio and (h / height) >= min_ratio
+def face_size_ok(landmarks: np.ndarray, width: int, height: int, min_ratio: float = 0.15) -> bool:
+    pts = np.asarray(landmarks, dtype=np.float64)
+    xs = pts[:, 0] * width
+    ys = pts[:, 1] * height
+    w = xs.max() - xs.min()
+    h = ys.max() - ys.min()
+    return bool((w / width) >= min_ratio and (h / height) >= min_ratio)
 
 
-def extract_landmarks(image_bytes: bytes) -> Tuple[Optional[List[Tuple[float, float, float]]], dict]:
+def extract_landmarks(image: ImageInput) -> Tuple[Optional[np.ndarray], dict]:
     """
-    Returns (landmarks, info). landmarks is a list of (x, y, z) or None if no face.
+    Returns (landmarks, info). landmarks is a (478, 3) float32 array of
+    normalized (x, y, z), or None if no face.
     info contains brightness, lighting_ok, face_detected flags.
+    Pass an ImageContext instead of bytes to share the decode with other steps.
     """
-    img = decode_image(image_bytes)
-    img = maybe_resize(img)
+    ctx = as_image_context(image)
     info = {
         "face_detected": False,
         "lighting_ok": False,
@@ -110,25 +313,25 @@ def extract_landmarks(image_bytes: bytes) -> Tuple[Optional[List[Tuple[float, fl
         "face_size_ok": False,
     }
 
-    brightness = get_brightness(img)
+    brightness = get_brightness(ctx)
     info["brightness"] = round(brightness, 2)
     info["lighting_ok"] = brightness >= 60
-    blur_score = get_blur_score(img)
+    blur_score = get_blur_score(ctx)
     info["blur_score"] = round(blur_score, 2)
     info["sharpness_ok"] = blur_score >= 30.0
 
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    result = _get_landmarker().detect(mp_image)
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=ctx.rgb)
+    with landmarker_pool.checkout() as landmarker:
+        result = landmarker.detect(mp_image)
 
     if not result.face_landmarks:
         return None, info
 
-    lms = result.face_landmarks[0]
-    landmarks = [(p.x, p.y, p.z) for p in lms]
+    landmarks = landmarks_array(result.face_landmarks[0])
 
     angle_ok = angle_ok_from_landmarks(landmarks)
     info["angle_ok"] = angle_ok
-    info["face_size_ok"] = face_size_ok(landmarks, img.shape[1], img.shape[0])
+    info["face_size_ok"] = face_size_ok(landmarks, ctx.width, ctx.height)
     info["face_detected"] = True
 
     # simple confidence score
@@ -152,19 +355,16 @@ LEFT_EYE_OUTER = 33
 RIGHT_EYE_OUTER = 263
 
 
-def angle_ok_from_landmarks(landmarks: List[Tuple[float, float, float]]) -> bool:
+def angle_ok_from_landmarks(landmarks: np.ndarray) -> bool:
     """
     Heuristic frontal/roll check using eye corners.
     Returns True if the roll angle is within a small threshold.
     """
-    try:
-        left = landmarks[LEFT_EYE_OUTER]
-        right = landmarks[RIGHT_EYE_OUTER]
-    except Exception:
+    pts = np.asarray(landmarks, dtype=np.float64)
+    if pts.ndim != 2 or pts.shape[0] <= max(LEFT_EYE_OUTER, RIGHT_EYE_OUTER):
         return False
 
-    dx = right[0] - left[0]
-    dy = right[1] - left[1]
+    dx, dy = pts[RIGHT_EYE_OUTER, :2] - pts[LEFT_EYE_OUTER, :2]
     if dx == 0 and dy == 0:
         return False
 
@@ -173,22 +373,23 @@ def angle_ok_from_landmarks(landmarks: List[Tuple[float, float, float]]) -> bool
 
 
 def draw_landmarks_on_image(
-    image_bytes: bytes, landmarks: List[Tuple[float, float, float]], radius: int = None
+    image: ImageInput, landmarks: np.ndarray, radius: int = None
 ) -> bytes:
     """
     Draw landmarks on the input image and return PNG bytes.
     Radius auto scales to image size if not provided.
     """
-    img = decode_image(image_bytes)
+    # draw on a copy so a shared ImageContext stays untouched
+    img = as_image_context(image).original.copy()
     h, w = img.shape[:2]
 
     # auto-scale radius to image size; keep a minimum so small images still visible
     if radius is None:
         radius = max(1, int(min(h, w) * 0.003) - 1)
 
-    for x, y, _ in landmarks:
-        px = int(x * w)
-        py = int(y * h)
+    # astype(int) truncates toward zero like int()
+    points = (np.asarray(landmarks, dtype=np.float64)[:, :2] * (w, h)).astype(int)
+    for px, py in points.tolist():
         cv2.circle(img, (px, py), radius, (0, 255, 0), thickness=-1)
 
     ok, buf = cv2.imencode(".png", img)
@@ -1,39 +1,767 @@
+import copy
 import json
 import math 
+import os
+import threading
+import warnings
+from collections.abc import Sequence
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple, List
 
-_CHAR_CACHE: Tuple[List[dict], dict, float] | None = None
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from animatch.app.services.catalog import (
+    OverlayTable, file_sha256, open_catalog, open_filters, open_graph, open_quantized, read_meta, write_catalog,
+)
+from animatch.app.services.index import boosted_scores, build_index, quantize, top_rows, update_index
+from animatch.app.services.schema import FEATURES
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+VECTORS_PATH = DATA_DIR / "anime_vectors.json"
+# compiled, mmap-able form of anime_vectors.json (see services/catalog.py)
+CATALOG_DIR = DATA_DIR / "catalog"
+# append-only log of update_characters() calls, replayed on top of the files above
+UPDATES_LOG = DATA_DIR / "catalog_updates.jsonl"
+# cross-process lock held while the dataset files or the log are read or written
+UPDATES_LOCK = DATA_DIR / "catalog_updates.lock"
+# fold the log into the dataset files once it holds this many entries
+COMPACT_EVERY = int(os.environ.get("ANIMATCH_COMPACT_EVERY", "500"))
+# neighbours kept per character in the "similar characters" graph
+SIMILAR_K = int(os.environ.get("ANIMATCH_SIMILAR_K", "16"))
+
+# nearest-neighbour backend used for the head of the ranking: exact | kdtree | ivf
+INDEX_BACKEND = os.environ.get("ANIMATCH_INDEX", "exact")
+INDEX_PARAMS = {
+    "ivf": {
+        "nlist": int(os.environ["ANIMATCH_IVF_NLIST"]) if os.environ.get("ANIMATCH_IVF_NLIST") else None,
+        "nprobe": int(os.environ.get("ANIMATCH_IVF_NPROBE", "8")),
+    },
+    # quantized scan: candidates rescored in float32 on top of the k requested
+    "int8": {"rerank": int(os.environ.get("ANIMATCH_QUANT_RERANK", "256"))},
+    "float16": {"rerank": int(os.environ.get("ANIMATCH_QUANT_RERANK", "256"))},
+}
+
+_CATALOG = None  # current Catalog snapshot; swapped as a whole, never mutated
+_RELOAD_LOCK = threading.RLock()
+_VERSION = 0  # bumped on every swap
+_JSON_HASH = (None, None)  # ((size, mtime_ns), sha256) of the last anime_vectors.json hashed
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _json_sha256():
+    """sha256 of anime_vectors.json (None if missing), rehashed only when its size or mtime changes."""
+    global _JSON_HASH
+    try:
+        st = VECTORS_PATH.stat()
+    except FileNotFoundError:
+        return None
+    key = (st.st_size, st.st_mtime_ns)
+    if _JSON_HASH[0] != key:
+        _JSON_HASH = (key, file_sha256(VECTORS_PATH))
+    return _JSON_HASH[1]
+
+
+def _dataset_source():
+    """(use_catalog, mtime, source_sha256) of the dataset load_characters should serve.
+    The compiled catalog is used when it was compiled from the anime_vectors.json
+    on disk (meta.json records the JSON's sha256) or there is no JSON. mtimes
+    only identify the dataset for reload_catalog: git does not keep them, so
+    they cannot tell which file is newer after a checkout."""
+    source = _json_sha256()
+    meta = read_meta(CATALOG_DIR)
+    use_catalog = meta is not None and (source is None or meta.get("source_sha256") == source)
+    mtime = _mtime(CATALOG_DIR / "meta.json") if use_catalog else _mtime(VECTORS_PATH)
+    if mtime is None:
+        raise FileNotFoundError(f"No dataset at {VECTORS_PATH} or {CATALOG_DIR}")
+    return use_catalog, mtime, source
+
+
+def _build_catalog(use_catalog, mtime, version, source=None):
+    opened = open_catalog(CATALOG_DIR, source_sha256=source) if use_catalog else None
+    if opened is not None and opened[0].features == features:
+        chars, stats, arrays = opened
+        quantized = open_quantized(CATALOG_DIR, INDEX_BACKEND)
+        filters = open_filters(CATALOG_DIR)
+    else:
+        with open(VECTORS_PATH, "r", encoding="utf-8") as file: #fetchs and appends anime vectors
+            chars = json.load(file)
+        stats = compute_stats(chars)
+        arrays = quantized = filters = None
+    catalog = Catalog(chars, stats, mtime, arrays, version=version, quantized=quantized, filters=filters)
+    if arrays is not None:
+        catalog.graph = open_graph(CATALOG_DIR)
+    # O(N^2), so it is built here with the rest of the snapshot rather than by
+    # the first /similar request; updated() below patches it for the log
+    catalog.neighbor_graph()
+    ops = _read_log()
+    return _replay(catalog, ops, version) if ops else catalog
+
+
+def _replay(catalog, ops, version):
+    """catalog.updated(ops) for log entries. An entry that does not apply is
+    skipped with a warning (it still counts towards `pending`) rather than
+    making every reload fail; the next compaction drops it from the log."""
+    try:
+        return catalog.updated(ops, version, strict=False)
+    except Exception:
+        pass
+    for op in ops:
+        try:
+            catalog = catalog.updated([op], version, strict=False)
+        except Exception as exc:
+            warnings.warn(f"Skipping catalog log entry {catalog.pending + 1} ({op[0]}): {type(exc).__name__}: {exc}")
+            catalog = copy.copy(catalog)
+            catalog.version = version
+            catalog.pending += 1
+    return catalog
+
+
+@contextmanager
+def _log_lock():
+    """Exclusive lock shared by every worker process on this dataset, so none
+    of them reads the files and log halfway through another's compaction or
+    appends to a log that is being folded. Read-only deployments, where nobody
+    can write the dataset, skip it."""
+    try:
+        fh = open(UPDATES_LOCK, "a+b")
+    except OSError:
+        yield
+        return
+    with fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _swap(catalog):
+    global _CATALOG, _VERSION
+    _VERSION = catalog.version
+    # one reference assignment: readers see the old snapshot or the new one, never a mix
+    _CATALOG = catalog
+    return catalog
+
+
+def _reload_locked(force):
+    """reload_catalog's body; the caller holds _RELOAD_LOCK and _log_lock.
+    A snapshot applies the first `pending` log entries on top of its files, so
+    with unchanged files only the entries other processes appended since are
+    replayed."""
+    use_catalog, mtime, source = _dataset_source()
+    current = _CATALOG
+    if current is not None and not force and current.mtime == mtime:
+        ops = _read_log()
+        if len(ops) == current.pending:
+            return current
+        if len(ops) > current.pending:
+            return _swap(_replay(current, ops[current.pending:], _VERSION + 1))
+    return _swap(_build_catalog(use_catalog, mtime, _VERSION + 1, source))
+
+
+def reload_catalog(force=False):
+    """Build a Catalog from the files on disk plus UPDATES_LOG and swap it in
+    as the current snapshot. Reloads are serialized, so concurrent triggers
+    never build the same dataset twice; unless `force`, unchanged files only
+    replay log entries the snapshot has not seen (usually none). If the build
+    fails (e.g. a half-written file) the old snapshot stays current and the
+    error propagates to the caller."""
+    with _RELOAD_LOCK, _log_lock():
+        return _reload_locked(force)
+
+
+def current_catalog():
+    """Current snapshot, or None before the first load. Never touches the disk."""
+    return _CATALOG
 
 
 def load_characters():
-    """Load characters once and cache with precomputed stats.
-    Auto-refreshes if the vectors file changes (mtime)."""
-    global _CHAR_CACHE
-    data_path = Path(__file__).resolve().parents[1] / "data" / "anime_vectors.json" #fetchs and appends anime vectors 
-    mtime = data_path.stat().st_mtime
-
-    if _CHAR_CACHE is not None:
-        cached_chars, cached_stats, cached_mtime = _CHAR_CACHE
-        if cached_mtime == mtime:
-            return _CHAR_CACHE
-
-    with open(data_path, "r", encoding="utf-8") as file:
-        chars = json.load(file)
+    """Current Catalog snapshot. Only the very first call reads the disk; after
+    that new datasets arrive through reload_catalog (see services/reloader.py),
+    so the request path never stats or parses the dataset files."""
+    catalog = _CATALOG
+    if catalog is None:
+        catalog = reload_catalog()
+    return catalog
+
+
+def catalog_arrays(chars, stats):
+    """Raw float64 vectors, z-scored float64 matrix and boost column for a list of characters."""
+    vectors = np.array([[c["vector"][f] for f in features] for c in chars], dtype=np.float64)
+    vectors = vectors.reshape(-1, len(features))
+    norm64 = normalize_rows(vectors, stats)
+    # same boost the per-character loop used to compute, done once per dataset
+    boost = 1.0 + np.minimum(row_norms(norm64) / 3.0, 0.4)
+    return vectors, norm64, boost
+
+
+def series_codes(chars, lookup=None):
+    """Integer code per character, equal codes for equal series. Pass `lookup`
+    to get the series -> code dict filled in."""
+    series = chars.column("series") if hasattr(chars, "column") else [c.get("series") for c in chars]
+    lookup = {} if lookup is None else lookup
+    return np.array([lookup.setdefault(name, len(lookup)) for name in series], dtype=np.int32)
+
+
+def _tag_lists(chars):
+    if hasattr(chars, "column"):
+        return [json.loads(t) if t else [] for t in chars.column("tags")]
+    return [c.get("tags") or [] for c in chars]
+
+
+def series_index(codes, n_series):
+    """Inverted index for filtered matching: series_rows[code] is the sorted
+    row-id array of that series."""
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=n_series) if len(codes) else np.zeros(n_series, dtype=np.intp)
+    return np.split(order, np.cumsum(counts)[:-1]) if n_series else []
+
+
+def tag_index(chars):
+    """Inverted index for filtered matching: {tag: sorted row-id array}."""
+    tag_rows = {}
+    for row, tags in enumerate(_tag_lists(chars)):
+        for tag in tags:
+            tag_rows.setdefault(tag, []).append(row)
+    return {tag: np.array(rows, dtype=np.intp) for tag, rows in tag_rows.items()}
+
+
+def export_catalog(chars, out_dir=CATALOG_DIR, source=VECTORS_PATH):
+    """Compile a list of characters into the binary catalog the API mmaps,
+    including its SIMILAR_K neighbour graph and the int8/float16 scan arrays,
+    so a quantized index never has to read the whole float32 matrix. `source`
+    is the JSON file `chars` were written to; its hash is recorded so the
+    server only prefers the catalog while that JSON is unchanged."""
     stats = compute_stats(chars)
-    _CHAR_CACHE = (chars, stats, mtime)
-    return _CHAR_CACHE
-
-features = [
-    "face_ratio",
-    "eye_spacing",
-    "eye_openness",
-    "jaw_angle",
-    "chin_ratio",
-    "brow_height",
-    "mouth_width",
-    "nose_length",
-]
+    vectors, norm64, boost = catalog_arrays(chars, stats)
+    graph = knn_graph(norm64, boost, SIMILAR_K)
+    norm = norm64.astype(FEATURES.dtype)
+    quantized = {dtype: quantize(norm, dtype) for dtype in ("int8", "float16")}
+    return write_catalog(out_dir, chars, features, stats, vectors, norm64, boost, graph,
+                         source_sha256=file_sha256(source) if source is not None else None, quantized=quantized)
+
+
+def _top_neighbors(cand, scores, k):
+    """Per row, the k best candidates by score, ties by row; -1 where a row
+    has fewer than k candidates with a finite score. Candidate lists are short,
+    so they are sorted whole instead of partitioned (ties need the full order)."""
+    order = np.lexsort((cand, -scores), axis=1)[:, :k]
+    cand, scores = np.take_along_axis(cand, order, 1), np.take_along_axis(scores, order, 1)
+    out = np.full((cand.shape[0], k), -1, dtype=np.int32)
+    out[:, :cand.shape[1]] = np.where(np.isfinite(scores), cand, -1)
+    return out
+
+
+def _pair_scores(norm, boost, rows, cand):
+    """Boosted similarity of each rows[i] to each cand[i, j], computed exactly
+    like match_characters' rerank (raw * boost, columns summed in order)."""
+    diff = norm[np.maximum(cand, 0)] - norm[rows][:, None, :]
+    total = diff[..., 0] * diff[..., 0]
+    for j in range(1, diff.shape[2]):
+        total = total + diff[..., j] * diff[..., j]
+    scores = 1.0 / (1.0 + np.sqrt(total)) * boost[np.maximum(cand, 0)]
+    scores[(cand < 0) | (cand == rows[:, None])] = -np.inf
+    return scores
+
+
+def knn_graph(norm, boost, k, rows=None):
+    """(R, k) nearest neighbours of `rows` (every row by default) under the
+    boosted similarity match_characters ranks by, best first, -1 padded.
+    `norm` is the float64 z-scored catalog. Rows are scanned in float32 blocks
+    with one matrix product each, then the best 2k per row are rescored exactly
+    so ties resolve by row like a stable sort."""
+    n = norm.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.intp)
+    if n < 2 or k <= 0:
+        return np.full((len(rows), max(k, 0)), -1, dtype=np.int32)
+    norm32 = np.asarray(norm, dtype=np.float32)
+    boost32 = np.asarray(boost, dtype=np.float32)
+    sq = np.einsum("ij,ij->i", norm32, norm32)
+    cand = np.arange(n)
+    block = max(1, _BATCH_BLOCK // n)
+    out = np.empty((len(rows), k), dtype=np.int32)
+    for start in range(0, len(rows), block):
+        r = rows[start:start + block]
+        # boost / (1 + |z_r - z|), in place: the block is the only large temporary
+        scores = norm32[r] @ norm32.T
+        scores *= -2.0
+        scores += sq[r][:, None]
+        scores += sq
+        np.maximum(scores, 0.0, out=scores)
+        np.sqrt(scores, out=scores)
+        scores += 1.0
+        np.divide(boost32, scores, out=scores)
+        if n > 2 * k:
+            part = np.argpartition(scores, n - 2 * k, axis=1)[:, n - 2 * k:]
+        else:
+            part = np.broadcast_to(cand, scores.shape)
+        out[start:start + len(r)] = _top_neighbors(part, _pair_scores(norm, boost, r, part), k)
+    return out
+
+
+def _updated_graph(graph, new_row, changed, norm, boost):
+    """Carry a neighbour graph across Catalog.updated without rebuilding it.
+    `new_row` maps old rows to new ones (-1 if deleted) and `changed` lists the
+    new rows that were added or replaced. Changed rows, and rows that lost a
+    neighbour to a delete, get a full knn_graph pass; every other row keeps its
+    list, rescored under the new stats, with the changed rows merged in."""
+    n, k = norm.shape[0], graph.shape[1]
+    if k == 0:
+        return np.zeros((n, 0), dtype=np.int32)
+    kept = new_row >= 0
+    old = np.asarray(graph)[kept]
+    nbrs = np.where(old >= 0, new_row[np.maximum(old, 0)], -1)
+    lost = ((old >= 0) & (nbrs < 0)).any(axis=1)
+    if len(changed):
+        nbrs[np.isin(nbrs, changed)] = -1
+    out = np.full((n, k), -1, dtype=np.int32)
+    out[:nbrs.shape[0]] = nbrs
+    dirty = np.zeros(n, dtype=bool)
+    dirty[:nbrs.shape[0]] = lost
+    dirty[changed] = True
+    clean = np.flatnonzero(~dirty)
+    width = k + len(changed)
+    block = max(1, _BATCH_BLOCK // (width * norm.shape[1]))
+    for start in range(0, len(clean), block):
+        r = clean[start:start + block]
+        cand = np.concatenate([out[r], np.broadcast_to(changed, (len(r), len(changed)))], axis=1)
+        out[r] = _top_neighbors(cand, _pair_scores(norm, boost, r, cand), k)
+    rows = np.flatnonzero(dirty)
+    out[rows] = knn_graph(norm, boost, k, rows)
+    return out
+
+
+class Catalog(Sequence):
+    """One dataset and everything derived from it, computed once per dataset
+    version so a request only has to score the user vector. Catalogs are
+    immutable snapshots; `version` tells them apart.
+
+    Indexing and iterating give the character dicts, like the old list. The
+    arrays are in `features` order: raw vectors, z-scored float32 `norm`, the
+    boost column, integer series codes and the INDEX_BACKEND index, plus
+    series/tag -> rows inverted indexes for filtered queries and the
+    "similar characters" graph. With the compiled catalog, vectors/norm/boost,
+    the series codes and tag rows, the graph and a quantized index's scan
+    arrays are the shared read-only mmaps."""
+
+    def __init__(self, chars, stats, mtime, arrays=None, version=0, quantized=None, filters=None):
+        if arrays is not None:
+            vectors, norm, boost = arrays
+        else:
+            vectors, norm64, boost = catalog_arrays(chars, stats)
+            norm = norm64.astype(FEATURES.dtype)
+        if filters is not None:
+            # compiled with the catalog, so no row has to be decoded
+            codes, names, tag_rows = filters
+            lookup = {name: code for code, name in enumerate(names)}
+        else:
+            lookup = {}
+            codes = series_codes(chars, lookup)
+            tag_rows = tag_index(chars)
+        params = dict(INDEX_PARAMS.get(INDEX_BACKEND, {}))
+        if quantized is not None:
+            params["quantized"] = quantized  # the compiled catalog's scan arrays
+        index = build_index(INDEX_BACKEND, norm, boost, **params)
+        # a compiled catalog keeps its rows in the mmap; their payloads are built per result
+        payloads = [_payload(c) for c in chars] if isinstance(chars, list) else None
+        self._set(chars, stats, mtime, version, vectors, norm, boost, codes, lookup, tag_rows, index, payloads)
+        self.pending = 0
+        # (N, K) neighbour rows; loaded with the compiled catalog, else built by _build_catalog
+        self.graph = None
+
+    def _set(self, chars, stats, mtime, version, vectors, norm, boost, codes, lookup, tag_rows, index, payloads):
+        self.chars = chars
+        self.stats = stats
+        self.mtime = mtime
+        self.version = version
+        self.vectors, self.norm, self.boost = vectors, norm, boost
+        self.mean = np.array([stats[f]["mean"] for f in features], dtype=np.float64)
+        self.std = np.array([stats[f]["std"] for f in features], dtype=np.float64)
+        # Welford sum of squared deviations, so updated() can move the stats incrementally
+        self.m2 = self.std ** 2 * max(len(chars) - 1, 1)
+        self.series_codes = codes
+        self.series_lookup = lookup
+        self.series_rows = series_index(codes, len(lookup))
+        self.tag_rows = tag_rows
+        self.index = index
+        # response dicts minus the score fields, filled in per match by result()
+        self.payloads = payloads
+        self._ids = None
+        self._gemm = None
+        self._series_stats = {}
+        self._graph_lock = threading.Lock()
+
+    def gemm_arrays(self):
+        """float32 squared row norms of `norm` and the largest row norm, for
+        match_characters_batch's matrix product; built on first use."""
+        if self._gemm is None:
+            sq = np.einsum("ij,ij->i", self.norm, self.norm)
+            self._gemm = (sq, float(np.sqrt(sq.max())) if sq.size else 0.0)
+        return self._gemm
+
+    def __len__(self):
+        return len(self.chars)
+
+    def __getitem__(self, row):
+        return self.chars[row]
+
+    def normalize(self, mat):
+        """normalize_rows with this dataset's stats."""
+        return _zscore(mat, self.mean, self.std)
+
+    def row_ids(self):
+        """{character id: row}, built on first use."""
+        if self._ids is None:
+            ids = self.chars.column("id") if hasattr(self.chars, "column") else [c["id"] for c in self.chars]
+            self._ids = {cid: row for row, cid in enumerate(ids)}
+        return self._ids
+
+    def neighbor_graph(self):
+        """(N, K) neighbour graph: each row's most similar other rows, best first.
+        Built once if the snapshot has none; concurrent callers wait for that build."""
+        if self.graph is None:
+            with self._graph_lock:
+                if self.graph is None:
+                    self.graph = knn_graph(self.normalize(_exact_rows(self.vectors, slice(None))), self.boost, SIMILAR_K)
+        return self.graph
+
+    def similar(self, row, top_k=10):
+        """Up to top_k characters most like catalog row `row`, as result dicts
+        scored like match results. Reads one graph row, so the cost is O(top_k)."""
+        nbrs = np.asarray(self.neighbor_graph()[row][:top_k])
+        nbrs = nbrs[nbrs >= 0]
+        z = self.normalize(_exact_rows(self.vectors, np.concatenate([[row], nbrs])))
+        raw = 1.0 / (1.0 + row_norms(z[1:] - z[0]))
+        return [self.result(int(j), float(r)) for j, r in zip(nbrs, raw)]
+
+    def _series_rows(self, name):
+        code = self.series_lookup.get(name)
+        return self.series_rows[code] if code is not None else np.zeros(0, dtype=np.intp)
+
+    def filter_rows(self, series=None, exclude_series=None, tags=None):
+        """Sorted rows in any of `series`, in none of `exclude_series` and
+        carrying every tag in `tags`, or None when nothing is filtered.
+        Built from the precomputed inverted indexes, so the cost is the size
+        of the lists involved rather than of the catalog."""
+        if not (series or exclude_series or tags):
+            return None
+        rows = None
+        if series:
+            rows = np.unique(np.concatenate([self._series_rows(s) for s in series]))
+        for tag in tags or ():
+            tagged = self.tag_rows.get(tag, np.zeros(0, dtype=np.intp))
+            rows = tagged if rows is None else np.intersect1d(rows, tagged, assume_unique=True)
+        if exclude_series:
+            drop = np.concatenate([self._series_rows(s) for s in exclude_series])
+            if rows is None:
+                keep = np.ones(len(self), dtype=bool)
+                keep[drop] = False
+                rows = np.flatnonzero(keep)
+            else:
+                rows = rows[~np.isin(rows, drop)]
+        return rows
+
+    def series_stats(self, name):
+        """Character count, tags and per-feature mean/std of one series, or
+        None if the catalog has no such series. Computed on first request."""
+        stats = self._series_stats.get(name)
+        if stats is None:
+            rows = self._series_rows(name)
+            if rows.size == 0:
+                return None
+            vectors = _exact_rows(self.vectors, rows)
+            std = vectors.std(axis=0, ddof=1) if rows.size > 1 else np.zeros(len(features))
+            tag_lists = [self.chars[int(r)].get("tags") or [] for r in rows]
+            stats = {
+                "series": name,
+                "characters": int(rows.size),
+                "tags": sorted({t for tags in tag_lists for t in tags}),
+                "mean": {f: round(float(v), 4) for f, v in zip(features, vectors.mean(axis=0))},
+                "std": {f: round(float(v), 4) for f, v in zip(features, std)},
+            }
+            self._series_stats[name] = stats
+        return stats
+
+    def updated(self, ops, version, strict=True):
+        """New snapshot with `ops` applied in order: ("upsert", character dict),
+        which replaces the row with the same id in place or appends, and
+        ("delete", id). Rows are not copied: the new snapshot's chars are an
+        OverlayTable over the same base table (the mmap for a compiled catalog)
+        holding only the edited records. Mean/std move by Welford updates
+        instead of a new compute_stats pass, z-scores and boosts are recomputed
+        with a few vectorized passes, the series/tag indexes and the graph are
+        patched and the index is updated with update_index. With strict=False,
+        deletes of unknown ids are skipped (log replay)."""
+        n0 = len(self.chars)
+        ids = dict(self.row_ids())
+        if isinstance(self.chars, OverlayTable):
+            base, extra, base_rows = self.chars.base, list(self.chars.extra), self.chars.rows
+        else:
+            base, extra, base_rows = self.chars, [], np.arange(n0)
+        payloads = self.payloads
+        pbase, pextra = (payloads.base, list(payloads.extra)) if isinstance(payloads, OverlayTable) else (payloads, [])
+
+        # room for every upsert to append; trimmed to the rows actually used below
+        size = n0 + sum(op == "upsert" for op, _ in ops)
+        source = np.empty(size, dtype=np.intp)
+        source[:n0] = base_rows
+        vectors = np.empty((size, len(features)), dtype=np.float64)
+        vectors[:n0] = self.vectors
+        if self.vectors.dtype == np.float32:
+            vectors[:n0] = np.round(vectors[:n0], 4)  # same undoing of the float32 cast as _exact_rows
+        codes = np.empty(size, dtype=np.int32)
+        codes[:n0] = self.series_codes
+        lookup = dict(self.series_lookup)
+        keep = np.zeros(size, dtype=bool)
+        keep[:n0] = True
+        n = n0
+        changed = set()
+        count, mean, m2 = n0, self.mean.copy(), self.m2.copy()
+
+        def add(x):
+            nonlocal count, mean, m2
+            count += 1
+            delta = x - mean
+            mean = mean + delta / count
+            m2 = m2 + delta * (x - mean)
+
+        def remove(x):
+            nonlocal count, mean, m2
+            if count <= 1:
+                count, mean, m2 = 0, np.zeros_like(mean), np.zeros_like(m2)
+                return
+            old = mean
+            count -= 1
+            mean = (old * (count + 1) - x) / count
+            m2 = np.maximum(m2 - (x - old) * (x - mean), 0.0)
+
+        for op, arg in ops:
+            if op == "upsert":
+                x = FEATURES.row(arg["vector"])
+                row = ids.get(arg["id"])
+                if row is None:
+                    row = ids[arg["id"]] = n
+                    n += 1
+                    keep[row] = True
+                else:
+                    remove(vectors[row])
+                changed.add(row)
+                source[row] = ~len(extra)
+                extra.append(arg)
+                if pbase is not None:
+                    pextra.append(_payload(arg))
+                vectors[row] = x
+                codes[row] = lookup.setdefault(arg.get("series"), len(lookup))
+                add(x)
+            elif op == "delete":
+                row = ids.pop(arg, None)
+                if row is None:
+                    if strict:
+                        raise KeyError(arg)
+                    continue
+                remove(vectors[row])
+                keep[row] = False
+            else:
+                raise ValueError(f"Unknown catalog op {op!r}")
+
+        keep = keep[:n]
+        new_row = np.cumsum(keep) - 1
+        new_row[~keep] = -1
+        source, vectors, codes = source[:n][keep], vectors[:n][keep], codes[:n][keep]
+        # drop records that were replaced again or deleted
+        edited = source < 0
+        used = ~source[edited]
+        source[edited] = ~np.arange(len(used))
+        chars = OverlayTable(base, source, [extra[j] for j in used])
+        if pbase is not None:
+            payloads = OverlayTable(pbase, source, [pextra[j] for j in used])
+        if not keep.all():
+            ids = {cid: int(new_row[row]) for cid, row in ids.items()}
+        moved = new_row[sorted(changed)]
+        moved = moved[moved >= 0]
+
+        std = np.sqrt(m2 / max(count - 1, 1)) if count else np.zeros_like(m2)
+        stats = {f: {"mean": float(mean[j]), "std": float(std[j])} for j, f in enumerate(features)}
+        norm64 = _zscore(vectors, mean, std)
+        boost = 1.0 + np.minimum(row_norms(norm64) / 3.0, 0.4)
+        norm = norm64.astype(FEATURES.dtype)
+        # old z -> new z is per-feature affine, which lets IVF keep its centroids
+        safe = np.where(std == 0, 1.0, std)
+        scale = np.where(std == 0, 0.0, self.std / safe)
+        shift = np.where(std == 0, 0.0, (self.mean - mean) / safe)
+        index = update_index(self.index, norm, boost, scale=scale, shift=shift)
+
+        # tag lists: renumber, drop the edited rows, then add their current tags
+        stale = np.zeros(len(chars), dtype=bool)
+        stale[moved] = True
+        tag_rows = {}
+        for tag, rows in self.tag_rows.items():
+            rows = new_row[rows]
+            rows = rows[rows >= 0]
+            rows = rows[~stale[rows]]
+            if rows.size:
+                tag_rows[tag] = rows
+        added = {}
+        for row in moved.tolist():
+            for tag in chars[row].get("tags") or []:
+                added.setdefault(tag, []).append(row)
+        for tag, rows in added.items():
+            tag_rows[tag] = np.union1d(tag_rows.get(tag, np.zeros(0, dtype=np.intp)), rows).astype(np.intp)
+
+        out = Catalog.__new__(Catalog)
+        out._set(chars, stats, self.mtime, version, vectors, norm, boost, codes, lookup, tag_rows, index, payloads)
+        out._ids = ids
+        out.pending = self.pending + len(ops)
+        out.graph = None
+        if self.graph is not None:
+            out.graph = _updated_graph(self.graph, new_row[:n0], moved, norm64, boost)
+        return out
+
+    def result(self, row, sim):
+        out = dict(self.payloads[row] if self.payloads is not None else _payload(self.chars[row]))
+        # Mild boost for friendly UX (cap at 100)
+        pct = max(0.0, min(100.0, sim * 100.0 * 1.75))
+        if pct >= 50:
+            badge = "Good"
+        elif pct >= 30:
+            badge = "OK"
+        else:
+            badge = "Weak"
+        out["similarity"] = round(sim, 4)
+        out["similarity_pct"] = round(pct, 1)
+        out["badge"] = badge
+        return out
+
+
+def _payload(c):
+    return {
+        "id": c["id"],
+        "name": c["name"],
+        "series": c["series"],
+        "similarity": None,
+        "similarity_pct": None,
+        "badge": None,
+        "vector": c["vector"],
+        "image_url": c.get("image_url"),
+        "overlay_url": c.get("overlay_url"),
+    }
+
+
+def _clean_record(c):
+    """Character dict in anime_vectors.json shape, features rounded to 4 places like the dataset."""
+    if not isinstance(c, dict):
+        raise TypeError("Each character must be a JSON object.")
+    for key in ("id", "name", "series"):
+        if not c.get(key):
+            raise ValueError(f"Character is missing {key!r}.")
+    row = FEATURES.row(c.get("vector") or {})
+    return {
+        "id": str(c["id"]),
+        "name": c["name"],
+        "series": c["series"],
+        "tags": list(c.get("tags") or []),
+        "vector": {f: round(v, 4) for f, v in FEATURES.as_dict(row).items()},
+        "image_url": c.get("image_url"),
+        "overlay_url": c.get("overlay_url"),
+    }
+
+
+def _read_log(repair=False):
+    """Ops in UPDATES_LOG, up to a torn last line left by a crash mid-append.
+    With `repair` the torn bytes are cut off so new entries stay readable."""
+    try:
+        data = UPDATES_LOG.read_bytes()
+    except FileNotFoundError:
+        return []
+    ops = []
+    good = 0
+    for line in data.splitlines(keepends=True):
+        try:
+            if not line.endswith(b"\n"):
+                raise ValueError("unterminated")
+            entry = json.loads(line)
+        except ValueError:
+            break
+        ops.append((entry["op"], entry["character"] if entry["op"] == "upsert" else entry["id"]))
+        good += len(line)
+    if repair and good < len(data):
+        with open(UPDATES_LOG, "r+b") as log:
+            log.truncate(good)
+    return ops
+
+
+def update_characters(upserts=(), deletes=()):
+    """Add or replace characters (dicts shaped like anime_vectors.json rows) and
+    delete ids without reloading the dataset. Under the cross-process log
+    lock the snapshot first catches up with entries other workers logged, then
+    the ops are applied to a copy of the snapshot with Catalog.updated and only
+    once that succeeded appended to UPDATES_LOG and swapped in, so an op that
+    fails never reaches the log. After COMPACT_EVERY logged ops the log is
+    folded into the dataset files. Returns the new Catalog."""
+    ops = [("upsert", _clean_record(c)) for c in upserts] + [("delete", str(i)) for i in deletes]
+    with _RELOAD_LOCK, _log_lock():
+        current = _reload_locked(False)
+        known = set(current.row_ids()) | {arg["id"] for op, arg in ops if op == "upsert"}
+        missing = [arg for op, arg in ops if op == "delete" and arg not in known]
+        if missing:
+            raise KeyError(f"Unknown character ids: {missing}")
+        if not ops:
+            return current
+        catalog = current.updated(ops, _VERSION + 1)
+        _read_log(repair=True)
+        with open(UPDATES_LOG, "a", encoding="utf-8") as log:
+            for op, arg in ops:
+                entry = {"op": op, "character": arg} if op == "upsert" else {"op": op, "id": arg}
+                log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        _swap(catalog)
+        if catalog.pending >= COMPACT_EVERY:
+            catalog = _compact_locked()
+        return catalog
+
+
+def compact_catalog():
+    """Fold UPDATES_LOG into anime_vectors.json and the compiled catalog, start
+    a fresh log and reload from the rewritten files (which also replaces the
+    incrementally updated stats with exact ones). Returns the new Catalog."""
+    with _RELOAD_LOCK, _log_lock():
+        return _compact_locked()
+
+
+def _compact_locked():
+    # every logged op, including other workers', must be in the snapshot written out
+    chars = list(_reload_locked(False).chars)
+    tmp = VECTORS_PATH.with_name(VECTORS_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(chars, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, VECTORS_PATH)
+    # compiled from the JSON just written, so its recorded hash matches
+    export_catalog(chars, CATALOG_DIR, source=VECTORS_PATH)
+    UPDATES_LOG.unlink(missing_ok=True)
+    return _reload_locked(True)
+
+# feature order shared by every array in this module (see services/schema.py)
+features = list(FEATURES.names)
 
 def compute_stats(characters):
     """Compute mean and std for each feature across the dataset."""
@@ -63,6 +791,26 @@ def normalize(vec, stats):
             out[f] = (vec[f] - stats[f]["mean"]) / std
     return out
 
+def normalize_rows(mat, stats):
+    """Z-score normalize an (N, 8) array of vectors in `features` order."""
+    mean = np.array([stats[f]["mean"] for f in features], dtype=np.float64)
+    std = np.array([stats[f]["std"] for f in features], dtype=np.float64)
+    return _zscore(mat, mean, std)
+
+
+def _zscore(mat, mean, std):
+    safe = np.where(std == 0, 1.0, std)
+    return np.where(std == 0, 0.0, (mat - mean) / safe)
+
+
+def row_norms(diff):
+    """Euclidean norm of each row, summing columns in order like distance()."""
+    total = diff[:, 0] * diff[:, 0]
+    for j in range(1, diff.shape[1]):
+        total = total + diff[:, j] * diff[:, j]
+    return np.sqrt(total)
+
+
 def distance(user_vector, char_vector):
     total = 0.0
     for i in features:
@@ -79,85 +827,211 @@ def center_distance(vec):
     return math.sqrt(total)
 
 
-def select_diverse(scored, top_k, min_dist=0.55):
-    """Pick results with series and geometry diversity."""
+def select_diverse(norm, series, top_k, min_dist=0.55, fill=True):
+    """Pick results with series and geometry diversity.
+    `norm` is the (M, 8) z-scored candidate pool in ranking order and `series`
+    its (M,) series codes; returns positions into the pool.
+
+    Greedy MMR-style pass: walk the ranking and take the next candidate whose
+    series is unused and that is at least `min_dist` from everything taken so far,
+    then relax to 0.6 * min_dist and ignore series if top_k is not filled.
+    Each candidate's distance to the selection is kept as a running minimum, so
+    every pick costs one vectorized (M, 8) distance update instead of a loop.
+    With fill=False the relaxed second pass is skipped, for callers that only
+    passed the head of the ranking and will retry with a longer one."""
+    m = norm.shape[0]
+    series = np.asarray(series)
     selected = []
-    used_series = set()
+    nearest = np.full(m, np.inf, dtype=np.float32)  # distance to the closest selected item
+    used = np.zeros(m, dtype=bool)  # candidate's series already taken
 
-    for item in scored:
-        if len(selected) >= top_k:
+    def take(i):
+        selected.append(i)
+        diff = norm - norm[i]
+        np.minimum(nearest, np.sqrt(np.einsum("ij,ij->i", diff, diff)), out=nearest)
+        nearest[i] = 0.0
+
+    pos = 0
+    while len(selected) < top_k:
+        ok = np.flatnonzero(~used[pos:] & (nearest[pos:] >= min_dist))
+        if ok.size == 0:
             break
-        series = item["char"].get("series")
-        if series in used_series:
-            continue
-        too_close = False
-        for s in selected:
-            if distance(item["norm"], s["norm"]) < min_dist:
-                too_close = True
-                break
-        if too_close:
-            continue
-        selected.append(item)
-        used_series.add(series)
-
-    if len(selected) < top_k:
-        for item in scored:
-            if len(selected) >= top_k:
+        pos += int(ok[0])
+        take(pos)
+        used |= series == series[pos]
+        pos += 1
+
+    if fill:
+        pos = 0
+        while len(selected) < top_k:
+            ok = np.flatnonzero(nearest[pos:] >= min_dist * 0.6)
+            if ok.size == 0:
                 break
-            too_close = False
-            for s in selected:
-                if distance(item["norm"], s["norm"]) < (min_dist * 0.6):
-                    too_close = True
-                    break
-            if too_close:
-                continue
-            selected.append(item)
+            pos += int(ok[0])
+            take(pos)
+            pos += 1
 
     return selected
 
 
-def match_characters (user_features, top_k=4): #default top 4 
-    chars, stats, _ = load_characters()
-    user_norm = normalize(user_features, stats)
-    scored = []
+_RERANK_TOL = 1e-4  # well above the float32 scoring error
 
-    for c in chars:
-        c_norm = normalize(c["vector"], stats)
-        d = distance(user_norm, c_norm)
-        sim = 1.0 / (1.0 + d)  # stay in (0,1]
-        # boost more distinctive faces so the "average" vector doesn't dominate
-        distinct = center_distance(c_norm)
-        boost = 1.0 + min(distinct / 3.0, 0.4)
-        sim_adj = sim * boost
-        scored.append({"sim": sim_adj, "raw": sim, "char": c, "norm": c_norm})
 
-    scored.sort(key=lambda x: x["sim"], reverse=True) #sorts by the first thing in tuple, from decending 
+def _exact_rows(vectors, rows):
+    out = np.asarray(vectors[rows], dtype=np.float64)
+    if vectors.dtype == np.float32:
+        # catalog features are stored rounded to 4 places; undo the float32 cast
+        out = np.round(out, 4)
+    return out
 
-    results = []
-    final = select_diverse(scored, top_k)
-    for item in final:#goes to scores takes top 3 
-        sim = item["raw"]
-        c = item["char"]
-        # Mild boost for friendly UX (cap at 100)
-        pct = max(0.0, min(100.0, sim * 100.0 * 1.75))
-        if pct >= 50:
-            badge = "Good"
-        elif pct >= 30:
-            badge = "OK"
+
+def _ranked(rows, sim32, pool, exact):
+    """Best-first catalog rows from an index search.
+    The candidates are rescored in float64 by `exact(rows)` and only the part of
+    the ranking that is provably the same as a full float64 sort is returned.
+    Ties keep catalog order, like a stable sort over the whole list."""
+    floor = -np.inf
+    if pool < sim32.shape[0]:
+        floor = np.partition(sim32, sim32.shape[0] - pool)[sim32.shape[0] - pool] - _RERANK_TOL / 2
+    rows = np.sort(rows)
+    raw, sim = exact(rows)
+    order = np.argsort(-sim, kind="stable")
+    order = order[sim[order] >= floor]
+    return rows[order], raw[order], sim[order]
+
+
+def _match_one(catalog, user_norm, top_k, search, allowed=None):
+    """Diverse top_k results for one z-scored (1, 8) query.
+    `search(pool)` returns candidate rows and their float32 scores for the head
+    of the ranking; it is asked again with a bigger pool if diversity needs it.
+    `allowed` restricts the results to those sorted rows (see Catalog.filter_rows)."""
+    norm, boost = catalog.norm, catalog.boost
+    universe = np.arange(norm.shape[0]) if allowed is None else allowed
+    n = len(universe)
+
+    def exact(rows):
+        raw = 1.0 / (1.0 + row_norms(catalog.normalize(_exact_rows(catalog.vectors, rows)) - user_norm))  # stay in (0,1]
+        # boost favours distinctive faces so the "average" vector doesn't dominate
+        return raw, raw * boost[rows]
+
+    # diversity usually fills top_k from the head of the ranking; widen the pool if not
+    pool = min(n, max(top_k * 16, 64))
+    while True:
+        if pool >= n:
+            rows, sim32 = universe, np.zeros(n)
         else:
-            badge = "Weak"
-        results.append({
-            "id": c["id"],
-            "name": c["name"],
-            "series": c["series"],
-            "similarity": round(sim, 4),
-            "similarity_pct": round(pct, 1),
-            "badge": badge,
-            "vector": c["vector"],
-            "image_url": c.get("image_url"),
-            "overlay_url": c.get("overlay_url"),
-        })
+            rows, sim32 = search(pool)
+        rows, raw, sim = _ranked(rows, sim32, pool, exact)
+        complete = len(rows) >= n
+        picked = select_diverse(norm[rows], catalog.series_codes[rows], top_k, fill=complete)
+        if len(picked) >= top_k or complete:
+            break
+        pool = min(n, pool * 4)
+
+    return [catalog.result(int(rows[j]), float(raw[j])) for j in picked]
+
+
+def _subset_search(catalog, rows, query):
+    """search() for a filtered query: a float32 scan of just `rows`."""
+    scores = None
+
+    def search(pool):
+        nonlocal scores
+        if scores is None:
+            scores = boosted_scores(catalog.norm[rows], catalog.boost[rows].astype(np.float32), query)
+        return top_rows(rows, scores, pool, _RERANK_TOL)
+    return search
+
+
+def match_characters (user_features, top_k=4, catalog=None, series=None, exclude_series=None, tags=None): #default top 4 
+    """Diverse top_k matches for one feature dict or vector. `series`,
+    `exclude_series` and `tags` restrict the candidates (see Catalog.filter_rows);
+    only the rows that pass are scored."""
+    if catalog is None:
+        catalog = load_characters()
+    user_norm = catalog.normalize(FEATURES.matrix([user_features]))
+    query = user_norm[0].astype(FEATURES.dtype)
+    allowed = catalog.filter_rows(series, exclude_series, tags)
+    if allowed is not None:
+        return _match_one(catalog, user_norm, top_k, _subset_search(catalog, allowed, query), allowed)
+    return _match_one(catalog, user_norm, top_k,
+                      lambda pool: catalog.index.search(query, pool, slack=_RERANK_TOL))
+
+
+# cap on the (queries x catalog) score block held at once
+_BATCH_BLOCK = 1 << 24
 
-    return results
 
+def _gemm_search(rows, approx, cat, boost, query, err):
+    """search() over scores from match_characters_batch's float32 matrix product.
+    `approx` is within `err` of the exact scan's scores, so every row the scan
+    would return is among those within 2 * err (+ slack) of the approximate
+    cut; those few are rescored like ExactIndex, which makes the result the
+    same as match_characters'."""
+    def search(pool):
+        cut = np.partition(approx, len(approx) - pool)[len(approx) - pool]
+        cand = np.flatnonzero(approx >= cut - 2.0 * err - _RERANK_TOL)
+        scores = boosted_scores(cat[cand], boost[cand], query)
+        return top_rows(rows[cand], scores, pool, _RERANK_TOL)
+    return search
 
+
+def match_characters_batch(user_features, top_k=4, catalog=None, series=None, exclude_series=None, tags=None):
+    """match_characters for many vectors at once: a list of feature dicts or
+    vectors, or a (B, 8) array, in FEATURES order. Returns one result list per
+    query, the same lists match_characters returns. The filters apply to every
+    query in the batch.
+
+    With the exact index the whole batch is scored against the float32 catalog
+    with one matrix product per block of queries; the rows near each query's
+    cut are then rescored like the scan and go through the same rerank and
+    diversity step as match_characters. Any other INDEX_BACKEND is searched
+    query by query, exactly as match_characters does. Pass `catalog` to score
+    against a specific snapshot."""
+    if catalog is None:
+        catalog = load_characters()
+    user_norm = catalog.normalize(FEATURES.matrix(user_features))
+    allowed = catalog.filter_rows(series, exclude_series, tags)
+    n = len(catalog) if allowed is None else len(allowed)
+    if n == 0:
+        return [[] for _ in range(user_norm.shape[0])]
+
+    if catalog.index.name != "exact":
+        queries = user_norm.astype(FEATURES.dtype)
+        if allowed is not None:
+            return [_match_one(catalog, u[None, :], top_k, _subset_search(catalog, allowed, q), allowed)
+                    for u, q in zip(user_norm, queries)]
+        return [_match_one(catalog, u[None, :], top_k,
+                           lambda pool, q=q: catalog.index.search(q, pool, slack=_RERANK_TOL))
+                for u, q in zip(user_norm, queries)]
+
+    # |q - z|^2 = |q|^2 - 2 q.z + |z|^2 in float32, straight off the (possibly mmapped) catalog
+    cat, boost = catalog.norm, catalog.index.boost
+    cat_sq, max_norm = catalog.gemm_arrays()
+    all_rows = np.arange(n)
+    if allowed is not None:
+        cat, cat_sq, boost, all_rows = cat[allowed], cat_sq[allowed], boost[allowed], allowed
+    max_boost = float(boost.max())
+    eps = float(np.finfo(np.float32).eps)
+    block = max(1, _BATCH_BLOCK // n)
+
+    results = []
+    for start in range(0, user_norm.shape[0], block):
+        users = user_norm[start:start + block]
+        queries = users.astype(np.float32)
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        scores = queries @ cat.T
+        scores *= -2.0
+        scores += cat_sq
+        scores += q_sq[:, None]
+        np.maximum(scores, 0.0, out=scores)
+        np.sqrt(scores, out=scores)
+        scores += 1.0
+        np.divide(boost, scores, out=scores)
+        for u, q, qs, row_scores in zip(users, queries, q_sq, scores):
+            # rounding in the expanded |q - z|^2 is at most ~(F + 4) eps (|q| + |z|)^2,
+            # and |sqrt(a) - sqrt(b)| <= sqrt(|a - b|) bounds what it does to the distance
+            err = max_boost * math.sqrt((len(features) + 4) * eps * (math.sqrt(float(qs)) + max_norm) ** 2)
+            search = _gemm_search(all_rows, row_scores, cat, boost, q, err)
+            results.append(_match_one(catalog, u[None, :], top_k, search, allowed))
+    return results
@@ -0,0 +1,92 @@
+"""Swaps in a new match catalog when the dataset files change on disk."""
+import os
+import threading
+import time
+from typing import Optional
+
+from animatch.app.services import match as match_service
+
+# set to 0 to disable the file watcher; POST /admin/reload still works
+WATCH_DATASET = os.environ.get("ANIMATCH_WATCH_DATASET", "1") != "0"
+
+
+class DatasetReloader:
+    """Single reloader for the match catalog. A watchfiles thread calls reload()
+    whenever anime_vectors.json, the compiled catalog's meta.json or the update
+    log is written, so every worker process picks up /admin/characters changes
+    made through another one; the admin endpoint calls it directly. Requests only ever read the current
+    snapshot, so they never stat or parse the dataset themselves."""
+
+    def __init__(self, watch: bool = WATCH_DATASET) -> None:
+        self.watch = watch
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_reload_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not self.watch or self._thread is not None:
+            return
+        try:
+            import watchfiles
+        except ImportError:
+            self.watch = False
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(watchfiles,), name="dataset-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, watchfiles) -> None:
+        targets = {
+            str(match_service.VECTORS_PATH),
+            str(match_service.CATALOG_DIR / "meta.json"),
+            str(match_service.UPDATES_LOG),
+        }
+        # the catalog writes meta.json last via os.replace, so its event means the arrays are in place
+        changes = watchfiles.watch(
+            match_service.DATA_DIR,
+            watch_filter=lambda _, path: path in targets,
+            stop_event=self._stop,
+        )
+        for _ in changes:
+            try:
+                self.reload()
+            except Exception:
+                pass  # counted in failures; the old snapshot keeps serving until the next write
+
+    def reload(self, force: bool = False):
+        """Rebuild and swap the catalog if the dataset changed (always if
+        `force`). Returns the current Catalog; re-raises build errors."""
+        before = match_service.current_catalog()
+        try:
+            catalog = match_service.reload_catalog(force=force)
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            raise
+        if catalog is not before:
+            self.reloads += 1
+            self.last_reload_at = time.time()
+        return catalog
+
+    def stats(self) -> dict:
+        catalog = match_service.current_catalog()
+        return {
+            "watching": self._thread is not None,
+            "version": catalog.version if catalog is not None else None,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_reload_at": self.last_reload_at,
+        }
+
+
+dataset_reloader = DatasetReloader()
@@ -0,0 +1,67 @@
+"""Canonical feature schema shared by features, match, explain and the catalog.
+
+Feature vectors travel through the pipeline as arrays in FEATURES.names order;
+dicts only appear at the JSON boundary (requests, responses, anime_vectors.json).
+"""
+import numpy as np
+
+
+class FeatureSchema:
+    """Ordered feature names plus the dtype catalog matrices are stored in.
+    Bump `version` whenever a feature is added, removed or redefined."""
+
+    def __init__(self, names, dtype=np.float32, version=1):
+        self.names = tuple(names)
+        self.dtype = np.dtype(dtype)
+        self.version = version
+        self.columns = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def row(self, values) -> np.ndarray:
+        """(F,) float64 vector from a feature dict or a sequence in schema order.
+        Missing or unknown dict keys raise instead of being silently dropped."""
+        if isinstance(values, dict):
+            missing = [f for f in self.names if f not in values]
+            if missing:
+                raise KeyError(f"Missing features {missing} (schema v{self.version}: {list(self.names)})")
+            unknown = [k for k in values if k not in self.columns]
+            if unknown:
+                raise ValueError(f"Unknown features {unknown} (schema v{self.version}: {list(self.names)})")
+            return np.array([values[f] for f in self.names], dtype=np.float64)
+        row = np.asarray(values, dtype=np.float64)
+        if row.shape != (len(self.names),):
+            raise ValueError(f"Expected {len(self.names)} features in order {list(self.names)}")
+        return row
+
+    def matrix(self, vectors) -> np.ndarray:
+        """(B, F) float64 matrix from a list of dicts/sequences or a (B, F) array."""
+        if isinstance(vectors, np.ndarray) and vectors.ndim == 2:
+            if vectors.shape[1] != len(self.names):
+                raise ValueError(f"Expected {len(self.names)} features in order {list(self.names)}")
+            return vectors.astype(np.float64, copy=False)
+        if isinstance(vectors, dict):
+            vectors = [vectors]
+        if len(vectors) == 0:
+            return np.zeros((0, len(self.names)))
+        return np.stack([self.row(v) for v in vectors])
+
+    def as_dict(self, row) -> dict:
+        """JSON form of one vector: {name: float} in schema order."""
+        return {f: float(v) for f, v in zip(self.names, row)}
+
+
+FEATURES = FeatureSchema([
+    "face_ratio",
+    "eye_spacing",
+    "eye_openness",
+    "jaw_angle",
+    "chin_ratio",
+    "brow_height",
+    "mouth_width",
+    "nose_length",
+])
@@ -1,8 +1,15 @@
+import argparse
 import json
+import sys
 import time
 from pathlib import Path
 
-import requests
+# Ensure project root on sys.path
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from animatch.app.services.fetch_cache import OFFLINE, FetchCache
 
 API_URL = "https://api.jikan.moe/v4/anime"
 VECTORS_PATH = Path("animatch/app/data/anime_vectors.json")
@@ -18,10 +25,12 @@ def load_series() -> list[str]:
     return sorted({c.get("series") for c in data if c.get("series")})
 
 
-def fetch_poster(title: str) -> dict:
-    resp = requests.get(API_URL, params={"q": title, "limit": 1}, timeout=20)
-    resp.raise_for_status()
-    items = resp.json().get("data", [])
+def _polite() -> None:
+    time.sleep(0.4)  # only before requests that actually reach Jikan
+
+
+def fetch_poster(title: str, cache: FetchCache) -> dict:
+    items = cache.get_json(API_URL, params={"q": title, "limit": 1}, throttle=_polite).get("data", [])
     if not items:
         return {"series": title, "image_url": "", "url": ""}
     item = items[0]
@@ -32,15 +41,19 @@ def fetch_poster(title: str) -> dict:
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offline", action="store_true", default=OFFLINE, help="Serve only from the fetch cache.")
+    args = parser.parse_args()
+
+    cache = FetchCache(offline=args.offline)
     series = load_series()
     results = []
     for title in series:
         try:
-            results.append(fetch_poster(title))
+            results.append(fetch_poster(title, cache))
         except Exception as exc:
             results.append({"series": title, "image_url": "", "url": ""})
             print(f"Warn: {title} -> {exc}")
-        time.sleep(0.4)
     OUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
     print(f"Saved {len(results)} series to {OUT_PATH}")
 
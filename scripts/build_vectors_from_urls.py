@@ -1,19 +1,28 @@
-
 import argparse
+import hashlib
 import json
+import multiprocessing
+import os
 import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Ensure project root on sys.path
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from animatch.app.services.landmarks import extract_landmarks, draw_landmarks_on_image
+from animatch.app.services import landmarks as landmarks_service
+from animatch.app.services.fetch_cache import CACHE_DIR, OFFLINE, FetchCache
+from animatch.app.services.landmarks import ImageContext, extract_landmarks, draw_landmarks_on_image
 from animatch.app.services.features import landmarks_to_features
+from animatch.app.services.schema import FEATURES
 
 
 HANDPICKED_DEFAULT = Path("animatch/data/handpicked_characters.json")
@@ -22,148 +31,546 @@ SAVE_FAILED = True
 FAILED_DIR = Path("animatch/data/failed_images")
 REPORT = Path("animatch/data/vector_build_report.txt")
 OVERLAY_DIR = Path("animatch/data/overlays")
+CHECKPOINT_DIR = Path("animatch/data/checkpoints")
+JIKAN_API = "https://api.jikan.moe/v4"
+
+# image downloads in flight at once
+DOWNLOADS_DEFAULT = 8
+# Jikan allows 3 requests/s and 60/min; stay at the per-minute rate with a small burst
+JIKAN_RATE_DEFAULT = 1.0
+JIKAN_BURST_DEFAULT = 3
+# highest confidence extract_landmarks can report; a face at this level ends a speculative fetch
+MAX_CONFIDENCE = 1.0
+
+
+class TokenBucket:
+    """Blocking rate limiter: acquire() returns once a token is available.
+    Tokens refill at `rate` per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
 
 
-def download_bytes(url: str) -> bytes:
-    r = requests.get(url, timeout=20)
-    r.raise_for_status()
-    return r.content
+class BuildStats:
+    """Counters shared by the download threads, printed as a throughput line."""
 
-def fetch_char_detail_image(char_id: int) -> list[str]:
-    """Try to get alternate image URLs from Jikan character detail."""
-    urls = []
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.started = time.monotonic()
+        self.done = 0
+        self.ok = 0
+        self.failed = 0
+        self.downloads = 0
+        self.bytes = 0
+        self.jikan_calls = 0
+        self.images = 0
+        self.cancelled = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0.0
+        return (
+            f"[{self.done}/{self.total}] {rate:.2f} chars/s | "
+            f"{self.downloads / elapsed:.1f} img/s {self.bytes / elapsed / 1e6:.2f} MB/s | "
+            f"{self.images / elapsed:.1f} detections/s | jikan {self.jikan_calls / elapsed:.2f} req/s | "
+            f"ok {self.ok} failed {self.failed} reused {self.reused} cancelled {self.cancelled} | "
+            f"eta {int(eta // 60)}m{int(eta % 60):02d}s"
+        )
+
+
+def model_version() -> str:
+    """Content hash of the landmarker model, so a replaced model invalidates checkpoints."""
     try:
-        resp = requests.get(f"https://api.jikan.moe/v4/characters/{char_id}", timeout=20)
-        resp.raise_for_status()
-        data = resp.json().get("data", {})
-        img = data.get("images", {}).get("jpg", {})
-        for key in ("image_url", "large_image_url", "small_image_url"):
-            u = img.get(key)
-            if u:
-                urls.append(u)
+        path = landmarks_service._ensure_model()
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:16]
     except Exception:
-        pass
-    return urls
+        return "missing"
+
+
+class Checkpoint:
+    """Append-only JSONL of finished characters, one line per build result.
+
+    An entry is reused while its key still matches: the character id, the
+    URLs it was built from, the sha256 of the image that produced the vector,
+    the landmarker model version and the feature schema version. Lines are
+    flushed and fsynced as they are written, so an interrupted build resumes
+    where it stopped; compact() keeps only the latest line per id."""
+
+    def __init__(self, path: Path, model: str, schema: int = FEATURES.version) -> None:
+        self.path = Path(path)
+        self.model = model
+        self.schema = schema
+        self.entries = self._read()
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return {}
+        entries = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn last line from a crash mid-append
+            entries[entry["id"]] = entry
+        return entries
+
+    @staticmethod
+    def sources(c: dict) -> str:
+        """Fingerprint of where a character's images come from."""
+        src = [c.get(k) or "" for k in ("image_large", "image_url", "image_small")] + [str(c.get("char_id") or "")]
+        return hashlib.sha256("\n".join(src).encode("utf-8")).hexdigest()[:16]
+
+    def lookup(self, c: dict):
+        """The entry for `c` if it was built from the same sources with the
+        current model and schema, else None. Image hashes are checked by the caller."""
+        entry = self.entries.get(c["id"])
+        if entry is None or entry["model"] != self.model or entry["schema"] != self.schema:
+            return None
+        return entry if entry["sources"] == self.sources(c) else None
+
+    def append(self, c: dict, status: str, record, image: bytes = None) -> None:
+        entry = {
+            "id": c["id"],
+            "sources": self.sources(c),
+            "image_sha256": hashlib.sha256(image).hexdigest() if record is not None and image else None,
+            "model": self.model,
+            "schema": self.schema,
+            "status": status,
+            "record": record,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[c["id"]] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+    def compact(self) -> None:
+        with self._lock:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self.entries.values()),
+                           encoding="utf-8")
+            os.replace(tmp, self.path)
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """Session with a connection pool sized for `pool_size` concurrent requests
+    and retries on transient server errors (429s are handled by jikan_get)."""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
-def fetch_char_pictures(char_id: int) -> list[str]:
-    """Fetch additional pictures from Jikan character pictures endpoint."""
-    urls = []
+def _init_worker() -> None:
+    # every worker process holds its own preloaded FaceLandmarker
+    landmarks_service._get_landmarker()
+
+
+def analyze_image(img_bytes: bytes):
+    """CPU step for one downloaded image, run in the worker pool.
+    Returns (vector, quality, overlay_png); vector is None if no face was found."""
+    image = ImageContext.from_bytes(img_bytes)
+    landmarks, quality = extract_landmarks(image)
+    if landmarks is None:
+        return None, quality, None
+    vector = landmarks_to_features(landmarks)
     try:
-        resp = requests.get(f"https://api.jikan.moe/v4/characters/{char_id}/pictures", timeout=20)
-        resp.raise_for_status()
-        data = resp.json().get("data", [])
-        for item in data:
-            img = item.get("jpg", {}).get("image_url")
-            if img:
-                urls.append(img)
+        overlay = draw_landmarks_on_image(image, landmarks)
     except Exception:
-        pass
-    return urls
+        overlay = None
+    return vector, quality, overlay
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--handpicked",
-        default=str(HANDPICKED_DEFAULT),
-        help="Path to handpicked JSON (default: animatch/data/handpicked_characters.json)",
-    )
-    parser.add_argument(
-        "--out",
-        default=str(OUT_DEFAULT),
-        help="Output path for vectors (default: animatch/app/data/anime_vectors.json)",
-    )
-    args = parser.parse_args()
+class VectorBuilder:
+    """Builds anime_vectors.json rows for many characters concurrently.
 
-    handpicked_path = Path(args.handpicked)
-    out_path = Path(args.out)
-    items = json.loads(handpicked_path.read_text(encoding="utf-8"))
-    results = []
-    failed = 0
-    noface = []
-    errors = []
-
-    if SAVE_FAILED:
-        FAILED_DIR.mkdir(parents=True, exist_ok=True)
-    OVERLAY_DIR.mkdir(parents=True, exist_ok=True)
-
-    for c in items:
-        urls_to_try = []
-        # Prefer largest image first, then fall back
-        if c.get("image_large"):
-            urls_to_try.append(c["image_large"])
-        if c.get("image_url"):
-            urls_to_try.append(c["image_url"])
-        if c.get("image_small"):
-            urls_to_try.append(c["image_small"])
-        if c.get("char_id"):
-            urls_to_try.extend(fetch_char_detail_image(c["char_id"]))
-            urls_to_try.extend(fetch_char_pictures(c["char_id"]))
-        # de-dupe while preserving order
-        seen = set()
-        urls_to_try = [u for u in urls_to_try if not (u in seen or seen.add(u))]
+    Each character runs on a thread: it downloads candidate images through a
+    pooled session (at most `downloads` at once) and hands them to a process
+    pool of `workers` warm landmarkers, trying URLs in order until one has a
+    face. Jikan lookups go through a token bucket so parallel characters never
+    exceed its rate limit. `workers=0` runs detection on the threads instead.
 
-        tried = False
-        success = False
+    With `speculative`, a character's candidate URLs are fetched in parallel
+    instead: each image is analyzed as it arrives, the face with the highest
+    `confidence` wins (ties go to the earlier URL) and the other fetches are
+    cancelled once nothing left can beat it. The handpicked URLs are raced
+    first; the Jikan pictures only if none of them has a face.
 
-        for url in urls_to_try:
-            if not url:
-                continue
+    Images and Jikan responses go through `cache` (a FetchCache), so a rebuild
+    only hits the network for URLs it has not seen or whose entry expired.
+    With a `checkpoint`, every result is appended to it as soon as it is known
+    and characters whose checkpoint key is unchanged skip detection entirely
+    (failures too, unless `retry_failed`)."""
+
+    def __init__(self, downloads: int = DOWNLOADS_DEFAULT, workers: int = os.cpu_count() or 1,
+                 jikan_rate: float = JIKAN_RATE_DEFAULT, jikan_burst: int = JIKAN_BURST_DEFAULT,
+                 speculative: bool = False, cache: FetchCache = None, checkpoint: Checkpoint = None,
+                 retry_failed: bool = False) -> None:
+        self.downloads = max(1, downloads)
+        self.workers = workers
+        self.speculative = speculative
+        self.checkpoint = checkpoint
+        self.retry_failed = retry_failed
+        self.cache = cache if cache is not None else FetchCache()
+        self.session = make_session(self.downloads + jikan_burst)
+        self.jikan = TokenBucket(jikan_rate, jikan_burst)
+        self._download_slots = threading.BoundedSemaphore(self.downloads)
+        self._pool = None
+        self._fetcher = None
+        self.stats = BuildStats(0)
+
+    def __enter__(self):
+        if self.workers > 0:
+            # spawn: forking a process that already runs MediaPipe threads is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        if self.speculative:
+            self._fetcher = ThreadPoolExecutor(max_workers=self.downloads, thread_name_prefix="fetch")
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._fetcher is not None:
+            self._fetcher.shutdown(cancel_futures=True)
+            self._fetcher = None
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        self.session.close()
+
+    def download_bytes(self, url: str, cancel: threading.Event = None) -> bytes:
+        """Body of `url`, from the cache or a download slot. With `cancel`, the
+        body is streamed and the download aborts as soon as the event is set."""
+        content = self.cache.get(url, session=self.session, slot=self._download_slots, cancel=cancel)
+        self.stats.add(downloads=1, bytes=len(content))
+        return content
+
+    def _jikan_throttle(self) -> None:
+        self.jikan.acquire()
+        self.stats.add(jikan_calls=1)
+
+    def jikan_get(self, path: str, retries: int = 3) -> dict:
+        """GET a Jikan endpoint (cached) under the rate limit, backing off on 429."""
+        for attempt in range(retries + 1):
+            try:
+                return self.cache.get_json(f"{JIKAN_API}{path}", session=self.session, throttle=self._jikan_throttle)
+            except requests.HTTPError as exc:
+                resp = exc.response
+                if resp is None or resp.status_code != 429 or attempt == retries:
+                    raise
+                time.sleep(float(resp.headers.get("Retry-After") or 2 ** attempt))
+
+    def fetch_char_detail_image(self, char_id: int) -> list[str]:
+        """Try to get alternate image URLs from Jikan character detail."""
+        urls = []
+        try:
+            data = self.jikan_get(f"/characters/{char_id}").get("data", {})
+            img = data.get("images", {}).get("jpg", {})
+            for key in ("image_url", "large_image_url", "small_image_url"):
+                u = img.get(key)
+                if u:
+                    urls.append(u)
+        except Exception:
+            pass
+        return urls
+
+    def fetch_char_pictures(self, char_id: int) -> list[str]:
+        """Fetch additional pictures from Jikan character pictures endpoint."""
+        urls = []
+        try:
+            for item in self.jikan_get(f"/characters/{char_id}/pictures").get("data", []):
+                img = item.get("jpg", {}).get("image_url")
+                if img:
+                    urls.append(img)
+        except Exception:
+            pass
+        return urls
+
+    def handpicked_urls(self, c: dict) -> list[str]:
+        """Image URLs stored with the character, largest first."""
+        urls = []
+        for key in ("image_large", "image_url", "image_small"):
+            u = c.get(key)
+            if u and u not in urls:
+                urls.append(u)
+        return urls
+
+    def jikan_urls(self, c: dict, skip=()) -> list[str]:
+        """Alternate image URLs from Jikan, minus the ones in `skip`."""
+        if not c.get("char_id"):
+            return []
+        urls = []
+        for u in self.fetch_char_detail_image(c["char_id"]) + self.fetch_char_pictures(c["char_id"]):
+            if u and u not in skip and u not in urls:
+                urls.append(u)
+        return urls
+
+    def candidate_urls(self, c: dict):
+        """Image URLs for one character, best first. The Jikan lookups only run
+        once the handpicked URLs are used up, since most characters never need them."""
+        urls = self.handpicked_urls(c)
+        yield from urls
+        yield from self.jikan_urls(c, skip=urls)
+
+    def analyze(self, img_bytes: bytes):
+        if self._pool is None:
+            result = analyze_image(img_bytes)
+        else:
+            result = self._pool.submit(analyze_image, img_bytes).result()
+        self.stats.add(images=1)
+        return result
+
+    def race(self, urls: list[str]):
+        """Fetch and analyze `urls` in parallel. Returns (best, image) where best
+        is (url, vector, quality, overlay) for the highest-confidence face,
+        earliest URL on ties, or None, and image the winning download (the
+        last one if there is no face)."""
+        cancel = threading.Event()
+        fetches = {self._fetcher.submit(self.download_bytes, u, cancel): i for i, u in enumerate(urls)}
+        analyses = {}
+        images = {}
+        finished = set()
+        best, best_i, best_conf = None, None, 0.0
+        last_bytes = None
+        pending = set(fetches)
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    pending.discard(fut)
+                    i = fetches.get(fut)
+                    result = None
+                    if i is not None:
+                        try:
+                            data = fut.result()
+                        except Exception:
+                            finished.add(i)
+                            continue
+                        last_bytes = images[i] = data
+                        if self._pool is not None:
+                            af = self._pool.submit(analyze_image, data)
+                            analyses[af] = i
+                            pending.add(af)
+                            continue
+                        try:
+                            result = analyze_image(data)
+                        except Exception:
+                            pass
+                    else:
+                        i = analyses[fut]
+                        try:
+                            result = fut.result()
+                        except Exception:
+                            pass
+                    finished.add(i)
+                    self.stats.add(images=1)
+                    if result is None or result[0] is None:
+                        continue
+                    conf = result[1].get("confidence") or 0.0
+                    if best is None or conf > best_conf or (conf == best_conf and i < best_i):
+                        best, best_i, best_conf = (urls[i],) + tuple(result), i, conf
+                # nothing still running can beat a top-confidence face from an earlier URL
+                if best is not None and best_conf >= MAX_CONFIDENCE and all(j in finished for j in range(best_i)):
+                    break
+        finally:
+            # queued fetches never start; running ones stop at their next chunk
+            cancel.set()
+            for fut in pending:
+                fut.cancel()
+            self.stats.add(cancelled=len(pending))
+        return best, (images[best_i] if best is not None else last_bytes)
+
+    def build_one(self, c: dict):
+        """(record, status, image) for one character, where status is "ok",
+        "no url" or "no face" and image the bytes the vector came from (for
+        "ok") or the last download tried."""
+        if self.speculative:
+            return self._build_one_speculative(c)
+        last_bytes = None
+        tried = False
+        for url in self.candidate_urls(c):
             tried = True
             try:
-                img_bytes = download_bytes(url)
-                landmarks, quality = extract_landmarks(img_bytes)
-                if landmarks is None:
-                    continue
-
-                vector = landmarks_to_features(landmarks)
-                overlay_url = None
-                try:
-                    overlay_bytes = draw_landmarks_on_image(img_bytes, landmarks)
-                    overlay_path = OVERLAY_DIR / f"{c['id']}.png"
-                    overlay_path.write_bytes(overlay_bytes)
-                    overlay_url = f"/static/overlays/{overlay_path.name}"
-                except Exception:
-                    overlay_url = None
-
-                record = {
-                    "id": c["id"],
-                    "name": c.get("name"),
-                    "series": c.get("series"),
-                    "tags": c.get("tags", []),
-                    "vector": vector,
-                    "image_url": url,
-                    "overlay_url": overlay_url,
-                }
-                results.append(record)
-                print("OK:", c["id"])
-                success = True
-                break
-            except Exception as exc:
-                # try next URL
+                last_bytes = self.download_bytes(url)
+                vector, quality, overlay = self.analyze(last_bytes)
+            except Exception:
+                continue  # try next URL
+            if vector is None:
+                continue
+            return self._record(c, url, vector, overlay), "ok", last_bytes
+        return None, ("no face" if tried else "no url"), last_bytes
+
+    def _build_one_speculative(self, c: dict):
+        handpicked = self.handpicked_urls(c)
+        tiers = [handpicked, lambda: self.jikan_urls(c, skip=handpicked)]
+        last_bytes = None
+        tried = False
+        for urls in tiers:
+            urls = urls() if callable(urls) else urls
+            if not urls:
                 continue
-            finally:
-                time.sleep(0.05)  # be polite but faster
-
-        if not success:
-            failed += 1
-            if not tried:
-                print("Skip (no url):", c["id"])
-                errors.append((c["id"], "no url"))
-            else:
-                print("No face or failed:", c["id"])
-                noface.append(c["id"])
-                if SAVE_FAILED and urls_to_try:
+            tried = True
+            best, data = self.race(urls)
+            last_bytes = data if data is not None else last_bytes
+            if best is not None:
+                url, vector, quality, overlay = best
+                return self._record(c, url, vector, overlay), "ok", data
+        return None, ("no face" if tried else "no url"), last_bytes
+
+    def build_or_reuse(self, c: dict):
+        """build_one, short-circuited by an unchanged checkpoint entry and
+        recorded in the checkpoint otherwise."""
+        if self.checkpoint is None:
+            return self.build_one(c)
+        reused = self._reuse(c, self.checkpoint.lookup(c))
+        if reused is not None:
+            self.stats.add(reused=1)
+            return reused
+        record, status, image = self.build_one(c)
+        self.checkpoint.append(c, status, record, image)
+        return record, status, image
+
+    def _reuse(self, c: dict, entry):
+        if entry is None:
+            return None
+        if entry["status"] != "ok":
+            return None if self.retry_failed else (None, entry["status"], None)
+        record = entry["record"]
+        overlay = record.get("overlay_url")
+        if overlay and not (OVERLAY_DIR / Path(overlay).name).exists():
+            return None
+        try:
+            # normally a fetch cache hit; the hash proves the image behind the URL is unchanged
+            image = self.download_bytes(record["image_url"])
+        except Exception:
+            return None
+        if hashlib.sha256(image).hexdigest() != entry["image_sha256"]:
+            return None
+        # names, series and tags may have been edited without touching the images
+        record = dict(record, name=c.get("name"), series=c.get("series"), tags=c.get("tags", []))
+        return record, "ok", image
+
+    def _record(self, c: dict, url: str, vector: dict, overlay) -> dict:
+        return {
+            "id": c["id"],
+            "name": c.get("name"),
+            "series": c.get("series"),
+            "tags": c.get("tags", []),
+            "vector": vector,
+            "image_url": url,
+            "overlay_url": self._save_overlay(c["id"], overlay),
+        }
+
+    def _save_overlay(self, char_id: str, overlay):
+        if overlay is None:
+            return None
+        try:
+            overlay_path = OVERLAY_DIR / f"{char_id}.png"
+            overlay_path.write_bytes(overlay)
+            return f"/static/overlays/{overlay_path.name}"
+        except Exception:
+            return None
+
+    def build(self, items: list[dict], progress_every: float = 5.0, on_result=None):
+        """Build every character; returns (results in input order, noface ids, errors).
+        `on_result(i, record)` is called as each character finishes, in completion
+        order, with record None if it failed."""
+        OVERLAY_DIR.mkdir(parents=True, exist_ok=True)
+        if SAVE_FAILED:
+            FAILED_DIR.mkdir(parents=True, exist_ok=True)
+        self.stats = BuildStats(len(items))
+        results = [None] * len(items)
+        noface = []
+        errors = []
+        # twice the download slots, so the CPU pool has work while the next images arrive
+        threads = ThreadPoolExecutor(max_workers=self.downloads * 2, thread_name_prefix="build")
+        try:
+            pending = {threads.submit(self.build_or_reuse, c): i for i, c in enumerate(items)}
+            last_report = time.monotonic()
+            while pending:
+                done, _ = wait(pending, timeout=progress_every, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = pending.pop(fut)
+                    c = items[i]
                     try:
-                        (FAILED_DIR / f"{c['id']}_last.jpg").write_bytes(img_bytes)
-                    except Exception:
-                        pass
+                        record, status, last_bytes = fut.result()
+                    except Exception as exc:
+                        record, status, last_bytes = None, f"error: {exc}", None
+                    self.stats.add(done=1)
+                    if on_result is not None:
+                        on_result(i, record)
+                    if record is not None:
+                        results[i] = record
+                        self.stats.add(ok=1)
+                        print("OK:", c["id"])
+                        continue
+                    self.stats.add(failed=1)
+                    if status == "no url":
+                        print("Skip (no url):", c["id"])
+                        errors.append((c["id"], "no url"))
+                    elif status == "no face":
+                        print("No face or failed:", c["id"])
+                        noface.append(c["id"])
+                        if SAVE_FAILED and last_bytes is not None:
+                            try:
+                                (FAILED_DIR / f"{c['id']}_last.jpg").write_bytes(last_bytes)
+                            except Exception:
+                                pass
+                    else:
+                        print("Failed:", c["id"], status)
+                        errors.append((c["id"], status))
+                if time.monotonic() - last_report >= progress_every or not pending:
+                    print(self.stats.line(), flush=True)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            if self.checkpoint is not None:
+                print(f"Interrupted after {self.stats.done} characters; rerun to resume from {self.checkpoint.path}")
+            raise
+        finally:
+            # on Ctrl-C, drop the queued characters instead of finishing them
+            threads.shutdown(wait=True, cancel_futures=True)
+        return [r for r in results if r is not None], noface, errors
 
-    out_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def write_report(items, results, noface, errors) -> None:
     report_lines = [
         f"Total entries: {len(items)}",
         f"Successful: {len(results)}",
-        f"Failed: {failed}",
+        f"Failed: {len(items) - len(results)}",
         f"No face: {', '.join(noface) if noface else '-'}",
         "Errors:",
     ]
@@ -174,6 +581,56 @@ def main() -> None:
 
     REPORT.write_text("\n".join(report_lines), encoding="utf-8")
 
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--handpicked",
+        default=str(HANDPICKED_DEFAULT),
+        help="Path to handpicked JSON (default: animatch/data/handpicked_characters.json)",
+    )
+    parser.add_argument(
+        "--out",
+        default=str(OUT_DEFAULT),
+        help="Output path for vectors (default: animatch/app/data/anime_vectors.json)",
+    )
+    parser.add_argument("--downloads", type=int, default=DOWNLOADS_DEFAULT, help="Image downloads in flight at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Landmark worker processes (0 runs detection on the download threads).")
+    parser.add_argument("--jikan-rate", type=float, default=JIKAN_RATE_DEFAULT, help="Jikan requests per second.")
+    parser.add_argument("--jikan-burst", type=int, default=JIKAN_BURST_DEFAULT, help="Jikan requests allowed back to back.")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between throughput lines.")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Fetch each character's candidate images in parallel and keep the most confident face.")
+    parser.add_argument("--cache-dir", default=str(CACHE_DIR), help="Download/Jikan cache directory.")
+    parser.add_argument("--offline", action="store_true", default=OFFLINE,
+                        help="Serve images and Jikan responses only from the cache.")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint JSONL (default: animatch/data/checkpoints/<out name>.jsonl).")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the checkpoint and rebuild every character.")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry characters the checkpoint records as having no face or no URL.")
+    args = parser.parse_args()
+
+    handpicked_path = Path(args.handpicked)
+    out_path = Path(args.out)
+    items = json.loads(handpicked_path.read_text(encoding="utf-8"))
+
+    cache = FetchCache(args.cache_dir, offline=args.offline)
+    checkpoint = Checkpoint(args.checkpoint or CHECKPOINT_DIR / f"{out_path.stem}.jsonl", model_version())
+    if args.rebuild:
+        checkpoint.entries = {}
+    with VectorBuilder(args.downloads, args.workers, args.jikan_rate, args.jikan_burst,
+                       speculative=args.speculative, cache=cache, checkpoint=checkpoint,
+                       retry_failed=args.retry_failed) as builder:
+        results, noface, errors = builder.build(items, progress_every=args.progress_every)
+    checkpoint.compact()
+    print("Fetch cache:", cache.stats())
+    cache.close()
+
+    out_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    write_report(items, results, noface, errors)
+    failed = len(items) - len(results)
     print(f"Done. Wrote {len(results)} entries to {out_path}. Failed: {failed}. See report: {REPORT}")
 
 
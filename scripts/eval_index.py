@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Ensure project root on sys.path
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from animatch.app.services import match as match_service
+from animatch.app.services.catalog import file_sha256, write_catalog
+from animatch.app.services.index import build_index, quantize
+from animatch.app.services.match import features, load_characters
+
+
+def synthetic_catalog(norm: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Grow the real z-scored catalog to `size` rows by jittering random characters."""
+    if size <= norm.shape[0]:
+        return norm
+    base = norm[rng.integers(0, norm.shape[0], size=size - norm.shape[0])]
+    extra = base + rng.normal(0.0, 0.35, size=base.shape).astype(np.float32)
+    return np.concatenate([norm, extra]).astype(np.float32)
+
+
+def boost_for(norm: np.ndarray) -> np.ndarray:
+    return 1.0 + np.minimum(np.sqrt((norm.astype(np.float64) ** 2).sum(axis=1)) / 3.0, 0.4)
+
+
+def time_queries(index, queries: np.ndarray, k: int) -> tuple[list[np.ndarray], np.ndarray]:
+    results, times = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        rows, _ = index.search(q, k)
+        times.append(time.perf_counter() - t0)
+        results.append(rows[:k])
+    return results, np.array(times) * 1000.0
+
+
+def recall(found: list[np.ndarray], truth: list[np.ndarray]) -> float:
+    hits = sum(len(np.intersect1d(f, t)) for f, t in zip(found, truth))
+    return hits / max(sum(len(t) for t in truth), 1)
+
+
+def report(label: str, rec: float, ms: np.ndarray) -> None:
+    print(
+        f"{label:<22} recall={rec:.4f}  mean={ms.mean():.3f}ms  "
+        f"p50={np.percentile(ms, 50):.3f}ms  p99={np.percentile(ms, 99):.3f}ms"
+    )
+
+
+def rss_mib() -> tuple[float, float]:
+    """(private, shared) resident memory of this process in MiB: anonymous
+    pages, and file-backed pages such as the catalog mmaps, which every worker
+    process shares through the page cache. Without /proc only the peak total
+    is available; it is reported as private."""
+    try:
+        fields = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines())
+        kib = {k: int(fields[k].split()[0]) for k in ("RssAnon", "RssFile", "RssShmem")}
+        return kib["RssAnon"] / 1024, (kib["RssFile"] + kib["RssShmem"]) / 1024
+    except (OSError, KeyError, ValueError):
+        import resource  # peak rather than current RSS, but the closest portable figure
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (peak / 2**20 if sys.platform == "darwin" else peak / 1024), 0.0
+
+
+def write_dataset(norm: np.ndarray, out_dir: Path) -> None:
+    """anime_vectors.json plus a compiled catalog (without the neighbour graph,
+    with the quantized scan arrays) for a z-scored matrix, mapped back to raw
+    features with the real stats."""
+    catalog = load_characters()
+    vectors = np.round(norm.astype(np.float64) * catalog.std + catalog.mean, 4)
+    chars = [
+        {"id": f"c{i}", "name": f"c{i}", "series": catalog[i % len(catalog)]["series"], "tags": [],
+         "vector": dict(zip(features, map(float, row)))}
+        for i, row in enumerate(vectors)
+    ]
+    json_path = out_dir / "anime_vectors.json"
+    json_path.write_text(json.dumps(chars), encoding="utf-8")
+    stats = match_service.compute_stats(chars)
+    raw, norm64, boost = match_service.catalog_arrays(chars, stats)
+    norm32 = norm64.astype(np.float32)
+    write_catalog(out_dir / "catalog", chars, features, stats, raw, norm64, boost,
+                  source_sha256=file_sha256(json_path),
+                  quantized={dtype: quantize(norm32, dtype) for dtype in ("int8", "float16")})
+
+
+def catalog_rss(data_dir: str, source: str, queries: int) -> None:
+    """Child process for --memory: load the catalog from `source` (mmap or
+    json) with the ANIMATCH_INDEX in the environment, run some matches and
+    print how much the process's private and shared RSS grew."""
+    data_dir = Path(data_dir)
+    match_service.VECTORS_PATH = data_dir / "anime_vectors.json"
+    match_service.CATALOG_DIR = data_dir / ("catalog" if source == "mmap" else "missing")
+    match_service.UPDATES_LOG = data_dir / "catalog_updates.jsonl"
+    match_service.UPDATES_LOCK = data_dir / "catalog_updates.lock"
+    # the mmap case is written without a neighbour graph; skip building one from the JSON too
+    match_service.SIMILAR_K = 0
+    before = rss_mib()
+    catalog = match_service.reload_catalog(force=True)
+    rng = np.random.default_rng(0)
+    for row in rng.integers(0, len(catalog), size=queries):
+        match_service.match_characters(catalog[int(row)]["vector"], catalog=catalog)
+    after = rss_mib()
+    print(f"{after[0] - before[0]:.1f} {after[1] - before[1]:.1f}")
+
+
+def report_memory(norm: np.ndarray, queries: int) -> None:
+    """Resident memory of the whole Catalog (arrays, index, inverted indexes)
+    per index backend, for the mmapped catalog and for anime_vectors.json.
+    Each case runs in a fresh process so nothing is shared between them."""
+    with tempfile.TemporaryDirectory() as tmp:
+        write_dataset(norm, Path(tmp))
+        print("Catalog RSS growth after loading and %d matches (MiB), private + shared page cache:" % queries)
+        print(f"{'index':<10} {'mmap private':>13} {'mmap shared':>12} {'json private':>13} {'json shared':>12}")
+        for backend in ("exact", "int8", "float16"):
+            row = []
+            for source in ("mmap", "json"):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--catalog-rss", tmp, source, "--queries", str(queries)],
+                    env=dict(os.environ, ANIMATCH_INDEX=backend), capture_output=True, text=True, check=True,
+                )
+                row.extend(map(float, out.stdout.strip().splitlines()[-1].split()))
+            print(f"{backend:<10} {row[0]:>13.1f} {row[1]:>12.1f} {row[2]:>13.1f} {row[3]:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall@k, latency and memory of the match indexes against the exact scan.")
+    parser.add_argument("--size", type=int, default=0, help="Grow the catalog to this many rows with jittered copies.")
+    parser.add_argument("--queries", type=int, default=500, help="Number of random queries.")
+    parser.add_argument("--k", type=int, default=64, help="Neighbours per query (match uses max(16 * top_k, 64)).")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF list count (default: sqrt(N)).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="IVF nprobe settings to sweep.")
+    parser.add_argument("--leaf-size", type=int, default=64, help="KD-tree leaf size.")
+    parser.add_argument("--rerank", type=int, nargs="+", default=[64, 256, 1024],
+                        help="Quantized-scan rerank depths to sweep (candidates rescored in float32 on top of k).")
+    parser.add_argument("--memory", action="store_true",
+                        help="Also measure resident memory of the whole catalog per backend (mmap vs JSON).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--catalog-rss", nargs=2, metavar=("DIR", "SOURCE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.catalog_rss:
+        catalog_rss(*args.catalog_rss, args.queries)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    norm = load_characters().norm
+    norm = synthetic_catalog(norm, args.size, rng)
+    boost = boost_for(norm)
+    picks = norm[rng.integers(0, norm.shape[0], size=args.queries)]
+    queries = (picks + rng.normal(0.0, 0.5, size=picks.shape)).astype(np.float32)
+    print(f"Catalog rows: {norm.shape[0]}  queries: {args.queries}  k: {args.k}")
+
+    exact = build_index("exact", norm, boost)
+    truth, ms = time_queries(exact, queries, args.k)
+    report("exact", 1.0, ms)
+
+    t0 = time.perf_counter()
+    kdtree = build_index("kdtree", norm, boost, leaf_size=args.leaf_size)
+    print(f"kdtree build: {time.perf_counter() - t0:.2f}s")
+    found, ms = time_queries(kdtree, queries, args.k)
+    report("kdtree", recall(found, truth), ms)
+
+    t0 = time.perf_counter()
+    ivf = build_index("ivf", norm, boost, nlist=args.nlist)
+    print(f"ivf build: {time.perf_counter() - t0:.2f}s  nlist={ivf.nlist}")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        found, ms = time_queries(ivf, queries, args.k)
+        report(f"ivf nprobe={nprobe}", recall(found, truth), ms)
+
+    for dtype in ("int8", "float16"):
+        t0 = time.perf_counter()
+        quant = build_index(dtype, norm, boost)
+        # the codes come on top of the float32 matrix the catalog keeps for reranking;
+        # see --memory for what that means for the whole process
+        print(f"{dtype} build: {time.perf_counter() - t0:.2f}s  codes {quant.nbytes / 2**20:.1f} MiB")
+        for rerank in args.rerank:
+            quant.rerank = rerank
+            found, ms = time_queries(quant, queries, args.k)
+            report(f"{dtype} rerank={rerank}", recall(found, truth), ms)
+
+    if args.memory:
+        report_memory(norm, min(args.queries, 200))
+
+
+if __name__ == "__main__":
+    main()
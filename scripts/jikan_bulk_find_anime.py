@@ -1,32 +1,46 @@
+import argparse
+import sys
 import time
-import requests
+from pathlib import Path
+
+# Ensure project root on sys.path
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from animatch.app.services.fetch_cache import OFFLINE, FetchCache
 
 API_URL = "https://api.jikan.moe/v4/anime"
 
-def best_match(title: str):
+def _polite():
+    time.sleep(0.35)  # be polite to Jikan; cache hits skip it
+
+def best_match(title: str, cache: FetchCache):
     # limit=1 returns the top match only
-    r = requests.get(API_URL, params={"q": title, "limit": 1})
-    r.raise_for_status()
-    data = r.json().get("data", [])
+    data = cache.get_json(API_URL, params={"q": title, "limit": 1}, throttle=_polite).get("data", [])
     if not data:
         return None, None
     return data[0].get("mal_id"), data[0].get("title")
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offline", action="store_true", default=OFFLINE, help="Serve only from the fetch cache.")
+    args = parser.parse_args()
+    cache = FetchCache(offline=args.offline)
+
     with open("anime_titles.txt", "r", encoding="utf-8") as f:
         titles = [line.strip() for line in f if line.strip()]
 
     print("mal_id,name")  # CSV header
 
     for t in titles:
-        mal_id, name = best_match(t)
+        mal_id, name = best_match(t, cache)
         if mal_id is None:
-            print(f',NOT_FOUND: "{t.replace("\"", "\"\"")}"')
+            safe_title = t.replace('"', '""')
+            print(f',NOT_FOUND: "{safe_title}"')
         else:
             safe_name = (name or "").replace('"', '""')
             print(f'{mal_id},"{safe_name}"')
 
-        time.sleep(0.35)  # be polite to Jikan
-
 if __name__ == "__main__":
     main()
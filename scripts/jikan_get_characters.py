@@ -1,35 +1,40 @@
-
+import argparse
 import json
 import sys
 import time
 from pathlib import Path
 
-import requests
+# Ensure project root on sys.path
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from animatch.app.services.fetch_cache import OFFLINE, FetchCache
 
 
-def fetch_characters(anime_id: int) -> list:
+def fetch_characters(anime_id: int, cache: FetchCache) -> list:
     url = f"https://api.jikan.moe/v4/anime/{anime_id}/characters"
-    res = requests.get(url, timeout=30)
-    res.raise_for_status()
-    return res.json().get("data", [])
+    return cache.get_json(url, timeout=30).get("data", [])
 
 
 def main() -> None:
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/jikan_get_characters.py <mal_anime_id>")
-        raise SystemExit(1)
+    parser = argparse.ArgumentParser(usage="python scripts/jikan_get_characters.py <mal_anime_id>")
+    parser.add_argument("anime_id", type=int)
+    parser.add_argument("--offline", action="store_true", default=OFFLINE, help="Serve only from the fetch cache.")
+    args = parser.parse_args()
 
-    anime_id = int(sys.argv[1])
-    data = fetch_characters(anime_id)
+    cache = FetchCache(offline=args.offline)
+    data = fetch_characters(args.anime_id, cache)
 
     out_dir = Path("animatch/data/jikan")
     out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"{anime_id}_characters.json"
+    out_path = out_dir / f"{args.anime_id}_characters.json"
     out_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
     print(f"Saved {len(data)} characters to {out_path}")
-    # Be polite to the API if running in a loop
-    time.sleep(0.35)
+    # Be polite to the API if running in a loop (cache hits never reached it)
+    if cache.misses:
+        time.sleep(0.35)
 
 
 if __name__ == "__main__":
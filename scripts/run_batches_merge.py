@@ -1,40 +1,135 @@
-
 import argparse
 import json
-import subprocess
+import os
 import sys
 from pathlib import Path
 
+# Ensure project root on sys.path
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from animatch.app.services.fetch_cache import CACHE_DIR, OFFLINE, FetchCache
+from animatch.app.services.match import export_catalog
+from scripts.build_vectors_from_urls import (
+    CHECKPOINT_DIR,
+    DOWNLOADS_DEFAULT,
+    JIKAN_BURST_DEFAULT,
+    JIKAN_RATE_DEFAULT,
+    REPORT,
+    Checkpoint,
+    VectorBuilder,
+    model_version,
+    write_report,
+)
+
 BATCH_DIR_DEFAULT = Path("animatch/data/batches_auto")
 MERGED_OUT_DEFAULT = Path("animatch/app/data/anime_vectors.json")
+CATALOG_DIR_DEFAULT = Path("animatch/app/data/catalog")
 BATCH_OUT_DIR = Path("animatch/data/batch_vectors")
 
 
+class BatchMerger:
+    """Collects builder results into the merged catalog as they arrive.
+
+    All batches are fed to one VectorBuilder, so characters from different
+    batches are built concurrently by the same warm worker pool. Each result
+    goes straight into its slot in the merged list (batch order, then input
+    order, as before); a batch's own output file is written the moment its
+    last character finishes."""
+
+    def __init__(self, batches: list[tuple[Path, list[dict]]]) -> None:
+        self.batches = batches
+        self.items = []
+        self.owner = []  # item index -> batch index
+        self.starts = []  # batch index -> first item index
+        for b, (_, items) in enumerate(batches):
+            self.starts.append(len(self.items))
+            self.items.extend(items)
+            self.owner.extend([b] * len(items))
+        self.results = [None] * len(self.items)
+        self.remaining = [len(items) for _, items in batches]
+
+    def add(self, i: int, record) -> None:
+        self.results[i] = record
+        b = self.owner[i]
+        self.remaining[b] -= 1
+        if self.remaining[b] == 0:
+            self._write_batch(b)
+
+    def _write_batch(self, b: int) -> None:
+        bf, items = self.batches[b]
+        start = self.starts[b]
+        data = [r for r in self.results[start:start + len(items)] if r is not None]
+        out_path = BATCH_OUT_DIR / f"{bf.stem}_vectors.json"
+        out_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Finished batch {bf.name}: {len(data)}/{len(items)} -> {out_path.name}")
+
+    def merged(self) -> list[dict]:
+        return [r for r in self.results if r is not None]
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--batch-dir", default=str(BATCH_DIR_DEFAULT), help="Directory of batch JSON files.")
     parser.add_argument("--out", default=str(MERGED_OUT_DEFAULT), help="Output path for merged vectors.")
+    parser.add_argument("--catalog-dir", default=str(CATALOG_DIR_DEFAULT), help="Output dir for the binary catalog the API mmaps.")
+    parser.add_argument("--compile-only", action="store_true", help="Skip the batches; just compile --out into --catalog-dir.")
+    parser.add_argument("--downloads", type=int, default=DOWNLOADS_DEFAULT, help="Image downloads in flight at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Landmark worker processes shared by all batches (0 runs detection on the download threads).")
+    parser.add_argument("--jikan-rate", type=float, default=JIKAN_RATE_DEFAULT, help="Jikan requests per second.")
+    parser.add_argument("--jikan-burst", type=int, default=JIKAN_BURST_DEFAULT, help="Jikan requests allowed back to back.")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between throughput lines.")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Fetch each character's candidate images in parallel and keep the most confident face.")
+    parser.add_argument("--cache-dir", default=str(CACHE_DIR), help="Download/Jikan cache directory.")
+    parser.add_argument("--offline", action="store_true", default=OFFLINE,
+                        help="Serve images and Jikan responses only from the cache.")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint JSONL (default: animatch/data/checkpoints/<out name>.jsonl).")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the checkpoint and rebuild every character.")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry characters the checkpoint records as having no face or no URL.")
     args = parser.parse_args()
 
+    merged_out = Path(args.out)
+    catalog_dir = Path(args.catalog_dir)
+    if args.compile_only:
+        combined = json.loads(merged_out.read_text(encoding="utf-8"))
+        export_catalog(combined, catalog_dir, source=merged_out)
+        print(f"Compiled {len(combined)} vectors from {merged_out} into {catalog_dir}")
+        return
+
     batch_dir = Path(args.batch_dir)
     if not batch_dir.exists():
         raise SystemExit(f"Batch dir not found: {batch_dir}")
 
     BATCH_OUT_DIR.mkdir(parents=True, exist_ok=True)
-    combined = []
-    batch_files = sorted(batch_dir.glob("*.json"))
-    for bf in batch_files:
-        out_path = BATCH_OUT_DIR / f"{bf.stem}_vectors.json"
-        print(f"Building batch {bf.name} -> {out_path.name}")
-        subprocess.check_call(
-            [sys.executable, "scripts/build_vectors_from_urls.py", "--handpicked", str(bf), "--out", str(out_path)]
-        )
-        data = json.loads(out_path.read_text(encoding="utf-8"))
-        combined.extend(data)
+    batches = [(bf, json.loads(bf.read_text(encoding="utf-8"))) for bf in sorted(batch_dir.glob("*.json"))]
+    merger = BatchMerger(batches)
+    print(f"Building {len(merger.items)} characters from {len(batches)} batches")
+
+    cache = FetchCache(args.cache_dir, offline=args.offline)
+    checkpoint = Checkpoint(args.checkpoint or CHECKPOINT_DIR / f"{merged_out.stem}.jsonl", model_version())
+    if args.rebuild:
+        checkpoint.entries = {}
+    with VectorBuilder(args.downloads, args.workers, args.jikan_rate, args.jikan_burst,
+                       speculative=args.speculative, cache=cache, checkpoint=checkpoint,
+                       retry_failed=args.retry_failed) as builder:
+        _, noface, errors = builder.build(merger.items, progress_every=args.progress_every, on_result=merger.add)
+    checkpoint.compact()
+    print("Fetch cache:", cache.stats())
+    cache.close()
+    combined = merger.merged()
+    write_report(merger.items, combined, noface, errors)
+    print(f"Built {len(combined)}/{len(merger.items)} characters. See report: {REPORT}")
 
-    merged_out = Path(args.out)
     merged_out.write_text(json.dumps(combined, ensure_ascii=False, indent=2), encoding="utf-8")
     print(f"Merged {len(combined)} vectors into {merged_out}")
+    # records the JSON's hash, so the API serves the catalog while the JSON is unchanged
+    export_catalog(combined, catalog_dir, source=merged_out)
+    print(f"Compiled binary catalog into {catalog_dir}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""Incremental catalog updates on a copy of the bundled dataset.
+
+Usage:
+  python scripts/test_catalog_updates.py
+"""
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from animatch.app.services import match
+
+
+def test_delete_without_neighbour_graph():
+    """ANIMATCH_SIMILAR_K=0 gives a graph with no columns; a delete-only
+    update must still apply, and the log it writes must replay."""
+    tmp = Path(tempfile.mkdtemp())
+    saved = (match.VECTORS_PATH, match.CATALOG_DIR, match.UPDATES_LOG, match.UPDATES_LOCK, match.SIMILAR_K, match._CATALOG)
+    try:
+        shutil.copy(match.VECTORS_PATH, tmp / "anime_vectors.json")
+        match.VECTORS_PATH = tmp / "anime_vectors.json"
+        match.CATALOG_DIR = tmp / "catalog"
+        match.UPDATES_LOG = tmp / "catalog_updates.jsonl"
+        match.UPDATES_LOCK = tmp / "catalog_updates.lock"
+        match.SIMILAR_K = 0
+        catalog = match.reload_catalog(force=True)
+        victim = catalog[0]["id"]
+
+        updated = match.update_characters(deletes=[victim])
+        assert len(updated) == len(catalog) - 1
+        assert victim not in updated.row_ids()
+        assert updated.neighbor_graph().shape == (len(updated), 0)
+
+        replayed = match.reload_catalog(force=True)
+        assert [c["id"] for c in replayed] == [c["id"] for c in updated]
+    finally:
+        (match.VECTORS_PATH, match.CATALOG_DIR, match.UPDATES_LOG, match.UPDATES_LOCK,
+         match.SIMILAR_K, match._CATALOG) = saved
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    test_delete_without_neighbour_graph()
+    print("OK")